@@ -0,0 +1,201 @@
+# bench.py
+# Offline benchmarks for the recipe pipeline.
+#
+# Pages are recorded once into a fixture directory (in pagecache's on-disk
+# format) and replayed with the page cache in offline mode, so runs never
+# touch the network and are comparable with each other.  The fixtures live
+# in bench_fixtures/ (ignored by git) unless BENCH_FIXTURE_DIR names another
+# directory.
+#
+#   python bench.py record [--per-set 10]      fetch fixtures from resources/*recipe_set.txt
+#   python bench.py run [--repeat 3] [-o out.json]
+#   python bench.py compare old.json new.json
+#
+# run writes one JSON document: per stage, the number of samples, p50, p95
+# and mean latency in milliseconds, and throughput in calls per second.
+
+import os
+import sys
+import json
+import glob
+import math
+import time
+import random
+import argparse
+import platform
+from copy import deepcopy
+from collections import OrderedDict
+
+import lazy
+import pagecache
+
+FIXTURE_DIR = os.environ.get('BENCH_FIXTURE_DIR', 'bench_fixtures')
+MANIFEST = 'manifest.json'
+RECIPE_SETS = 'resources/*recipe_set.txt'
+CUISINES = ['indian', 'german', 'french', 'african', 'healthy', 'lowfat', 'lowcal']
+
+def fixture_cache(offline):
+    return pagecache.PageCache(root=FIXTURE_DIR, max_bytes=None, offline=offline)
+
+def record(per_set, seed=0):
+    """Fetch per_set URLs from every recipe set into FIXTURE_DIR."""
+    rng = random.Random(seed)
+    cache = fixture_cache(offline=False)
+    manifest = OrderedDict()
+    for file in sorted(glob.glob(RECIPE_SETS)):
+        with open(file) as fin:
+            urls = [l.strip() for l in fin if l.strip()]
+        chosen = rng.sample(urls, min(per_set, len(urls)))
+        failed = set(cache.warm(chosen))
+        manifest[os.path.basename(file)] = [url for url in chosen if url not in failed]
+    if not os.path.isdir(FIXTURE_DIR):
+        os.makedirs(FIXTURE_DIR)
+    with open(os.path.join(FIXTURE_DIR, MANIFEST), 'w') as fout:
+        json.dump(manifest, fout, indent=2)
+    return manifest
+
+def fixture_urls():
+    with open(os.path.join(FIXTURE_DIR, MANIFEST)) as fin:
+        manifest = json.load(fin)
+    return [url for urls in manifest.itervalues() for url in urls]
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not samples:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(samples)))
+    return samples[max(rank, 1) - 1]
+
+class Timings(object):
+    """Wall-clock samples, in seconds, for each named stage."""
+
+    def __init__(self):
+        self.samples = OrderedDict()
+
+    def time(self, stage, function, *args, **kwargs):
+        start = time.time()
+        result = function(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.time() - start)
+        return result
+
+    def summary(self):
+        ret = OrderedDict()
+        for stage, samples in self.samples.iteritems():
+            samples = sorted(samples)
+            total = sum(samples)
+            ret[stage] = OrderedDict([
+                ('n', len(samples)),
+                ('p50_ms', percentile(samples, 50) * 1000),
+                ('p95_ms', percentile(samples, 95) * 1000),
+                ('mean_ms', total / len(samples) * 1000),
+                ('throughput_per_s', len(samples) / total if total else None),
+            ])
+        return ret
+
+def bench_recipe(url, timings):
+    """Time every stage of fetch_recipe and the transforms for one page."""
+    from recipe import RecipeDocument, parse_ingredient, get_ingredients, get_methods, \
+        get_tools, get_steps, get_structuredsteps, convertCuisine, makeVegetarian, \
+        replaceIngredients, ingredient_cache
+
+    html = timings.time('fetch', pagecache.fetch, url)
+    doc = timings.time('parse_document', RecipeDocument.from_html, html)
+    for line in doc.ingredients:
+        timings.time('parse_ingredient', parse_ingredient, line.lower())
+    ingredient_cache.clear() # Time get_ingredients cold, not on the lines just parsed.
+    recipe = {}
+    timings.time('get_ingredients', get_ingredients, doc, recipe)
+    timings.time('get_methods', get_methods, doc, recipe)
+    timings.time('get_tools', get_tools, doc, recipe)
+    timings.time('get_steps', get_steps, doc, recipe)
+    timings.time('get_structuredsteps', get_structuredsteps, doc, recipe)
+
+    rng = random.Random(0)
+    for cuisine in CUISINES:
+        subs = timings.time('convertCuisine:' + cuisine, convertCuisine, recipe, cuisine)
+        timings.time('replaceIngredients', replaceIngredients, deepcopy(recipe), subs, rng)
+    subs = timings.time('makeVegetarian', makeVegetarian, recipe)
+    timings.time('replaceIngredients', replaceIngredients, deepcopy(recipe), subs, rng)
+
+def bench_app(url, timings):
+    """Time /fetchRecipe end to end through Flask's test client, cold and cached."""
+    import main
+    from recipe import ingredient_cache
+    client = main.app.test_client()
+    body = json.dumps({'url': url, 'cuisine': 'indian', 'veg': True, 'seed': 0})
+    for cache in (main.recipe_cache, main.result_cache, ingredient_cache):
+        cache.clear()
+    for stage in ('fetchRecipe', 'fetchRecipe:cached'):
+        response = timings.time(stage, client.post, '/fetchRecipe', data=body)
+        if response.status_code != 200:
+            raise RuntimeError('/fetchRecipe returned %s' % response.status)
+
+def run(repeat):
+    pagecache.page_cache = fixture_cache(offline=True)
+    urls = fixture_urls()
+    start = time.time()
+    lazy.warm_up(background=False)
+    loaded = time.time() - start
+
+    timings = Timings()
+    failed = []
+    for _ in xrange(repeat):
+        for url in urls:
+            try:
+                bench_recipe(url, timings)
+                bench_app(url, timings)
+            except Exception as e:
+                failed.append(url)
+                sys.stderr.write('Warning: could not benchmark %s: %s\n' % (url, e))
+    return OrderedDict([
+        ('meta', OrderedDict([
+            ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('python', platform.python_version()),
+            ('pages', len(urls)),
+            ('repeat', repeat),
+            ('failed', len(failed)),
+            ('load_s', loaded),
+            ('components', lazy.status()),
+        ])),
+        ('stages', timings.summary()),
+    ])
+
+def compare(old, new):
+    """Print the p50 and p95 change of every stage between two run outputs."""
+    old, new = old['stages'], new['stages']
+    print '%-28s %12s %12s %8s %12s %12s %8s' % ('stage', 'p50 old', 'p50 new', 'change', 'p95 old', 'p95 new', 'change')
+    for stage in new:
+        if stage not in old:
+            continue
+        row = [stage]
+        for key in ('p50_ms', 'p95_ms'):
+            a, b = old[stage][key], new[stage][key]
+            row += [a, b, (b - a) / a * 100 if a else 0.0]
+        print '%-28s %12.3f %12.3f %+7.1f%% %12.3f %12.3f %+7.1f%%' % tuple(row)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recipe pipeline offline.')
+    commands = parser.add_subparsers(dest='command')
+    record_parser = commands.add_parser('record', help='record fixture pages')
+    record_parser.add_argument('--per-set', type=int, default=10)
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('-o', '--output')
+    compare_parser = commands.add_parser('compare', help='compare two run outputs')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        manifest = record(args.per_set)
+        print 'Recorded %d pages into %s' % (sum(len(urls) for urls in manifest.itervalues()), FIXTURE_DIR)
+    elif args.command == 'run':
+        results = json.dumps(run(args.repeat), indent=2)
+        if args.output:
+            with open(args.output, 'w') as fout:
+                fout.write(results + '\n')
+        else:
+            print results
+    else:
+        with open(args.old) as a, open(args.new) as b:
+            compare(json.load(a), json.load(b))
@@ -0,0 +1,70 @@
+# cache.py
+# Small in-memory caches shared by the parser and the web server.
+
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded least-recently-used cache.
+
+    If ttl is given, entries expire that many seconds after they are put.
+    hits, misses, evictions and expirations are counted so the cache can be
+    sized from real traffic; stats() returns them as a dict.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict() # key -> (value, expiry time or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            if entry is not _MISSING and entry[1] is not None and entry[1] <= time.time():
+                self.expirations += 1
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data[key] = entry # Move to the most recently used end.
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,189 @@
+# compact.py
+# An array-backed, read-only form of the food graph.
+#
+# Nodes are interned as integer ids, numbered so that parents come before
+# their children.  Parent and child edges are stored in CSR form (an offsets
+# array plus one flat array of ids), and each node's ancestor closure is a
+# single integer used as a bitset; since every ancestor has a smaller id, a
+# node's bitset is never longer than its own id.  CompactNode views
+# expose the parts of the Node API that only need the graph's shape.
+
+from array import array
+from food import graph_tables, read_snapshot_tables, food_graph, snapshot_key, \
+	CATEGORY_FILES, SUBSTITUTE_FILES, PROPERTIES_FILES, SYNONYM_FILES, SNAPSHOT_FILE
+
+def _csr(adjacency):
+	"""Pack a list of id lists into (offsets, ids) arrays."""
+	offsets = array('i', [0])
+	ids = array('i')
+	for neighbors in adjacency:
+		ids.extend(neighbors)
+		offsets.append(len(ids))
+	return offsets, ids
+
+def _bits(bitset):
+	"""Yield the positions of the set bits of an integer, lowest first."""
+	while bitset:
+		low = bitset & -bitset
+		yield low.bit_length() - 1
+		bitset ^= low
+
+def _topological_order(parents):
+	"""Order node ids so every node comes after all of its parents."""
+	pending = [len(p) for p in parents]
+	children = [[] for _ in parents]
+	for i, ps in enumerate(parents):
+		for p in ps:
+			children[p].append(i)
+	order = [i for i in xrange(len(parents)) if not pending[i]]
+	for i in order: # order grows as nodes become ready.
+		for c in children[i]:
+			pending[c] -= 1
+			if not pending[c]:
+				order.append(c)
+	return order
+
+class CompactGraph(object):
+	def __init__(self, tables):
+		order = _topological_order(tables['parents'])
+		new_id = [0] * len(order)
+		for new, old in enumerate(order):
+			new_id[old] = new
+		def remap(adjacency):
+			return [[new_id[j] for j in adjacency[old]] for old in order]
+
+		self.names = tuple(tables['names'][old] for old in order)
+		self.lemmas = tuple(tuple(tables['lemmas'][old]) for old in order)
+		self.properties = tuple(tuple(tables['properties'][old]) for old in order)
+		self.ids = dict((name, new_id[i]) for name, i in tables['index'])
+		parents = remap(tables['parents'])
+		self.parent_offsets, self.parent_ids = _csr(parents)
+		self.child_offsets, self.child_ids = _csr(remap(tables['children']))
+		self.cancel_offsets, self.cancel_ids = _csr(remap(tables['cancels']))
+		self.ancestor_bits = self._close(parents)
+		self._descendant_bits = None
+		self.root = self.view(new_id[tables['root']])
+
+	@classmethod
+	def from_graph(cls, root):
+		return cls(graph_tables(root))
+
+	@classmethod
+	def from_snapshot(cls, file, key):
+		"""Load a snapshot straight into compact form, or return None."""
+		tables = read_snapshot_tables(file, key)
+		return cls(tables) if tables is not None else None
+
+	def __len__(self):
+		return len(self.names)
+
+	def _close(self, parents):
+		"""Compute every node's ancestor bitset; ids are already topologically ordered."""
+		bits = [0] * len(parents)
+		for i, ps in enumerate(parents):
+			for p in ps:
+				bits[i] |= bits[p] | (1 << p)
+		return bits
+
+	def _neighbors(self, offsets, ids, i):
+		return ids[offsets[i]:offsets[i + 1]]
+
+	def descendant_bits(self, i):
+		if self._descendant_bits is None:
+			bits = [0] * len(self.names)
+			for j, ancestors in enumerate(self.ancestor_bits):
+				for a in _bits(ancestors):
+					bits[a] |= 1 << j
+			self._descendant_bits = bits
+		return self._descendant_bits[i]
+
+	def view(self, i):
+		return CompactNode(self, i)
+
+	def views(self, ids):
+		return [CompactNode(self, i) for i in ids]
+
+	def node(self, name):
+		"""Return the view for the node indexed under name, or None."""
+		i = self.ids.get(name)
+		return CompactNode(self, i) if i is not None else None
+
+	def is_a(self, i, ancestor):
+		return bool(self.ancestor_bits[i] >> ancestor & 1)
+
+class CompactNode(object):
+	"""A lightweight view of one node of a CompactGraph."""
+	__slots__ = ('graph', 'id')
+
+	def __init__(self, graph, id):
+		self.graph = graph
+		self.id = id
+
+	def __eq__(self, other):
+		return isinstance(other, CompactNode) and self.graph is other.graph and self.id == other.id
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash(self.id)
+
+	def __str__(self):
+		return '<Node %s>' % self.name
+
+	def __repr__(self):
+		return '<Node %s>' % self.name
+
+	@property
+	def name(self):
+		return self.graph.names[self.id]
+
+	@property
+	def lemmas(self):
+		return list(self.graph.lemmas[self.id])
+
+	@property
+	def properties(self):
+		return list(self.graph.properties[self.id])
+
+	@property
+	def parents(self):
+		g = self.graph
+		return g.views(g._neighbors(g.parent_offsets, g.parent_ids, self.id))
+
+	@property
+	def children(self):
+		g = self.graph
+		return g.views(g._neighbors(g.child_offsets, g.child_ids, self.id))
+
+	@property
+	def cancels(self):
+		g = self.graph
+		return g.views(g._neighbors(g.cancel_offsets, g.cancel_ids, self.id))
+
+	@property
+	def ancestors(self):
+		return set(self.graph.views(_bits(self.graph.ancestor_bits[self.id])))
+
+	@property
+	def descendants(self):
+		return set(self.graph.views(_bits(self.graph.descendant_bits(self.id))))
+
+	def is_a(self, ancestor):
+		return self.graph.is_a(self.id, ancestor.id)
+
+	def shared_ancestors(self, other):
+		bits = self.graph.ancestor_bits
+		return set(self.graph.views(_bits(bits[self.id] & bits[other.id])))
+
+def compact_food_graph(cats=CATEGORY_FILES, subs=SUBSTITUTE_FILES, props=PROPERTIES_FILES,
+						syns=SYNONYM_FILES, snapshot=SNAPSHOT_FILE):
+	"""
+	Return the food graph as a CompactGraph.  If a matching snapshot exists
+	it is loaded directly, without ever creating Node objects.
+	"""
+	if snapshot:
+		graph = CompactGraph.from_snapshot(snapshot, snapshot_key(cats + subs + props + syns))
+		if graph:
+			return graph
+	return CompactGraph.from_graph(food_graph(cats, subs, props, syns, snapshot=snapshot))
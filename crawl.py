@@ -1,12 +1,17 @@
 # crawl.py
 # Utilities for crawling AllRecipes.com and collecting a sample set.
 
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing
 from bs4 import BeautifulSoup
-import requests as r
-import urllib
-from urlparse import urljoin
+import pagecache
+from urlparse import urljoin, urlparse
 from recipe import *
-from collections import Counter
+from collections import Counter, deque
 
 FREQ_FILE_I = 'resources/freq_set_i.txt'
 FREQ_FILE_F = 'resources/freq_set_f.txt'
@@ -30,10 +35,10 @@ RECIPE_LOWFAT_FOOD = 'resources/lowFat_recipe_set.txt'
 BASE_URL = 'http://allrecipes.com'
 
 def parse_url(url):
-	return BeautifulSoup(r.get(url).content, 'html.parser')
+	return BeautifulSoup(pagecache.fetch(url), 'html.parser')
 
 def similar_links(page):
-	soup = url if isinstance(page, BeautifulSoup) else parse_url(page)
+	soup = page if isinstance(page, BeautifulSoup) else parse_url(page)
 	return [a['href'] for a in soup.find_all('a', attrs={'data-internal-referrer-link': 'similar_recipe_banner'})]
 
 def read_recipe_file(file=RECIPE_FILE):
@@ -44,21 +49,127 @@ def write_recipe_file(links, file=RECIPE_FILE):
 	with open(file, 'w') as fout:
 		fout.writelines([l + '\n' for l in links])
 
-def crawl(links, queue, limit=100):
-	while len(links) < limit and queue:
-		link, queue = queue[0], queue[1:]
-		print 'Processing:', link
-		similar = similar_links(link)
-		for s in similar:
-			if s[0] == '/':
-				s = BASE_URL + s
-			if s not in links:
-				print 'Added to queue:', s
-				links.append(s)
-				queue.append(s)
-			else:
-				print 'Skipped:', s
-	return links
+# Number of pages fetched at once, and politeness limits for any one host.
+CRAWL_WORKERS = 8
+CRAWL_PER_HOST = 2 # Concurrent requests.
+CRAWL_DELAY = 0.5 # Seconds between requests to the same host.
+CRAWL_CHECKPOINT_EVERY = 25 # Pages processed between checkpoints.
+
+class Crawler(object):
+	"""
+	Breadth-first crawl of similar_links, fetching pages on a pool of
+	worker threads.
+
+	links is the list of recipes found so far and is extended in place.
+	queue holds the links still to be processed.  If checkpoint names a
+	file, the visited links and the frontier are saved there periodically,
+	and a crawl started with an existing checkpoint resumes from it.
+	"""
+
+	def __init__(self, links, queue, limit=100, workers=CRAWL_WORKERS,
+					per_host=CRAWL_PER_HOST, delay=CRAWL_DELAY,
+					checkpoint=None, checkpoint_every=CRAWL_CHECKPOINT_EVERY):
+		self.links = links
+		self.frontier = deque(queue)
+		self.limit = limit
+		self.workers = workers
+		self.per_host = per_host
+		self.delay = delay
+		self.checkpoint_file = checkpoint
+		self.checkpoint_every = checkpoint_every
+		if checkpoint and os.path.exists(checkpoint):
+			self.restore(checkpoint)
+		self.seen = set(self.links) | set(self.frontier)
+		self.in_flight = set()
+		self.processed = 0
+		self._cond = threading.Condition()
+		self._hosts = {}
+		self._hosts_lock = threading.Lock()
+
+	def done(self):
+		return len(self.links) >= self.limit or not (self.frontier or self.in_flight)
+
+	def _host_slot(self, url):
+		host = urlparse(url).netloc
+		with self._hosts_lock:
+			if host not in self._hosts:
+				self._hosts[host] = [threading.Semaphore(self.per_host), 0.0, threading.Lock()]
+			return self._hosts[host]
+
+	def fetch_similar(self, link):
+		semaphore, _, lock = slot = self._host_slot(link)
+		with semaphore:
+			with lock:
+				wait = slot[1] + self.delay - time.time()
+				if wait > 0:
+					time.sleep(wait)
+				slot[1] = time.time()
+			similar = similar_links(link)
+		return [BASE_URL + s if s.startswith('/') else s for s in similar]
+
+	def _work(self):
+		while True:
+			with self._cond:
+				while not self.frontier and not self.done():
+					self._cond.wait()
+				if self.done():
+					self._cond.notify_all()
+					return
+				link = self.frontier.popleft()
+				self.in_flight.add(link)
+			sys.stdout.write('Processing: %s\n' % link)
+			try:
+				similar = self.fetch_similar(link)
+			except Exception as e:
+				sys.stderr.write('Warning: could not crawl %s: %s\n' % (link, e))
+				similar = []
+			with self._cond:
+				self.in_flight.discard(link)
+				self.processed += 1
+				for s in similar:
+					if s in self.seen:
+						continue
+					if len(self.links) >= self.limit:
+						break
+					self.seen.add(s)
+					self.links.append(s)
+					self.frontier.append(s)
+				if self.checkpoint_file and self.processed % self.checkpoint_every == 0:
+					self.save(self.checkpoint_file)
+				self._cond.notify_all()
+
+	def run(self):
+		threads = [threading.Thread(target=self._work) for _ in range(self.workers)]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		for thread in threads:
+			while thread.is_alive():
+				thread.join(1) # A timeout keeps the main thread responsive to ^C.
+		if self.checkpoint_file:
+			self.save(self.checkpoint_file)
+		return self.links
+
+	def save(self, file):
+		"""Atomically write the visited links and frontier (including pages in flight)."""
+		state = {
+			'limit': self.limit,
+			'links': self.links,
+			'frontier': sorted(self.in_flight) + list(self.frontier),
+		}
+		tmp = file + '.tmp'
+		with open(tmp, 'w') as fout:
+			json.dump(state, fout)
+		os.rename(tmp, file)
+
+	def restore(self, file):
+		with open(file) as fin:
+			state = json.load(fin)
+		self.links[:] = [str(l) for l in state['links']]
+		self.frontier = deque(str(l) for l in state['frontier'])
+
+def crawl(links, queue, limit=100, workers=CRAWL_WORKERS, checkpoint=None):
+	return Crawler(links, queue, limit=limit, workers=workers, checkpoint=checkpoint).run()
 
 
 
@@ -71,7 +182,7 @@ def collect_recipe_file(links, file=RECIPE_AFRICAN_FOOD):
 
 
 def fetchRecipeURL(input_url):
-    r = urllib.urlopen(input_url).read()
+    r = pagecache.fetch(input_url)
     soup = BeautifulSoup(r, "html.parser")
     baseSite = 'http://allrecipes.com'
     links = set()
@@ -107,19 +218,69 @@ def write_freq_file(links, file):
 		fout.writelines([l + '\n' for l in links])
 
 
-def freq_ingredient(read_file, write_file):
-	recipe_list = read_recipe_file(read_file)
+# Recipes handed to each worker process at a time.
+FREQ_CHUNK_SIZE = 10
+
+def _count_chunk(recipes):
+	"""Count ingredient names over a chunk of recipe URLs; runs in a worker process."""
 	cnt = Counter()
-	for i, recipe in enumerate(recipe_list):
-		temp = fetch_recipe(recipe)
-		print "Processing %s out of %s..." % (i, len(recipe_list))
+	failures = []
+	for recipe in recipes:
+		try:
+			temp = fetch_recipe(recipe)
+		except Exception as e:
+			failures.append((recipe, '%s: %s' % (type(e).__name__, e)))
+			continue
 		for ingredient in temp.get('ingredients'):
 			cnt[ingredient.get('name')] += 1
+	return cnt, failures, len(recipes)
 
-
-	for x, v in cnt.most_common():
-		with open(write_file, 'a+') as fout:
+def write_freq_counts(cnt, file):
+	"""Atomically replace file with the counts in cnt, most common first."""
+	tmp = file + '.tmp'
+	with open(tmp, 'w') as fout:
+		for x, v in sorted(cnt.iteritems(), key=lambda item: (-item[1], item[0])):
 			fout.write(str(x) + ": " + str(v) + "\n")
+	os.rename(tmp, file)
+
+def freq_ingredient(read_file, write_file, processes=None, chunk_size=FREQ_CHUNK_SIZE):
+	"""
+	Count ingredient names over every recipe in read_file and write the
+	frequencies to write_file.
+
+	Recipes are parsed in chunks on a pool of processes (one per CPU by
+	default) and the per-chunk Counters are merged as they arrive.  Recipes
+	that fail to parse are skipped and listed in write_file + '.failed'.
+
+	Return the merged Counter and the list of (url, error) failures.
+	"""
+	recipe_list = read_recipe_file(read_file)
+	chunks = [recipe_list[i:i + chunk_size] for i in range(0, len(recipe_list), chunk_size)]
+	cnt = Counter()
+	failures = []
+	done = 0
+	start = time.time()
+	pool = multiprocessing.Pool(processes)
+	try:
+		for chunk_cnt, chunk_failures, n in pool.imap_unordered(_count_chunk, chunks):
+			cnt.update(chunk_cnt)
+			failures += chunk_failures
+			done += n
+			elapsed = time.time() - start
+			print "Processed %s out of %s (%.2f recipes/s, %s failed)..." % \
+				(done, len(recipe_list), done / elapsed if elapsed else 0.0, len(failures))
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+	write_freq_counts(cnt, write_file)
+	if failures:
+		with open(write_file + '.failed', 'w') as fout:
+			fout.writelines(['%s\t%s\n' % failure for failure in failures])
+	return cnt, failures
 
 
 def read_freq_file(file=FREQ_FILE_I):
@@ -135,8 +296,9 @@ def read_freq_file(file=FREQ_FILE_I):
 
 
 
-freq_ingredient(RECIPE_LOWFAT_FOOD, FREQ_FILE_LOWFAT)
-freq_ingredient(RECIPE_LOWCAL_FOOD, FREQ_FILE_LOWCAL)
+if __name__ == '__main__':
+	freq_ingredient(RECIPE_LOWFAT_FOOD, FREQ_FILE_LOWFAT)
+	freq_ingredient(RECIPE_LOWCAL_FOOD, FREQ_FILE_LOWCAL)
 '''
 write_freq_file("http://allrecipes.com/recipes/1232/healthy-recipes/low-calorie/", FREQ_FILE_LOWCAL)
 write_freq_file("http://allrecipes.com/recipes/1231/healthy-recipes/low-fat/", FREQ_FILE_LOWFAT)
@@ -0,0 +1,62 @@
+# document.py
+# The parts of an AllRecipes page the recipe parser needs, extracted once.
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+INGREDIENT_ITEMPROP = 'ingredients'
+DIRECTION_CLASS = 'recipe-directions__list--item'
+
+# Prefer lxml when it is installed; it is several times faster than the
+# pure-Python html.parser and produces the same spans for these pages.
+try:
+    import lxml
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+def _classes(attrs):
+    value = attrs.get('class') or ''
+    return value.split() if isinstance(value, basestring) else value
+
+def _wanted(name, attrs):
+    """Return True for the only tags fetch_recipe ever looks at."""
+    if name == 'title':
+        return True
+    if name != 'span' or not attrs:
+        return False
+    attrs = dict(attrs)
+    return attrs.get('itemprop') == INGREDIENT_ITEMPROP or \
+        DIRECTION_CLASS in _classes(attrs)
+
+RECIPE_STRAINER = SoupStrainer(_wanted)
+
+
+class RecipeDocument(object):
+    """
+    The title, ingredient lines and direction lines of a recipe page.
+
+    Built once per page and handed to every analyzer, so the HTML is only
+    parsed once and only the tags we need are ever turned into a tree.
+    """
+
+    def __init__(self, title, ingredients, directions):
+        self.title = title
+        self.ingredients = ingredients
+        self.directions = directions
+        self.steps = [direction.lower() for direction in directions]
+        self.directions_string = ''.join(' ' + direction for direction in directions)
+
+    def __repr__(self):
+        return '<RecipeDocument %r: %d ingredients, %d directions>' % \
+            (self.title, len(self.ingredients), len(self.directions))
+
+    @classmethod
+    def from_soup(cls, soup):
+        title = soup.title.text if soup.title else u''
+        ingredients = [span.get_text() for span in soup.find_all('span', itemprop=INGREDIENT_ITEMPROP)]
+        directions = [str(span.text) for span in soup.find_all('span', class_=DIRECTION_CLASS)]
+        return cls(title, ingredients, directions)
+
+    @classmethod
+    def from_html(cls, markup, parser=PARSER):
+        return cls.from_soup(BeautifulSoup(markup, parser, parse_only=RECIPE_STRAINER))
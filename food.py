@@ -1,9 +1,16 @@
 # food.py
 # Python classes and methods for handling food taxonomy.
 
-from nltk import wordnet
-wn = wordnet.wordnet
+import os
+import sys
+import imp
+import marshal
+import hashlib
+import threading
+from bisect import bisect_left
+from itertools import chain, islice
 from util import loadCategorization
+from collections import defaultdict
 
 # Whether to use a fallback strategy when matching a query to a node.
 FALLBACK = True
@@ -16,6 +23,24 @@ SUBSTITUTE_FILES = ['resources/VegetarianIngredientSubstitutes.csv'] #, 'resourc
 SYNONYM_FILES = [] # ['resources/fs_synonyms.txt']
 # Properties to attach to various nodes.
 PROPERTIES_FILES = ['resources/food_properties.txt']
+# Length of the longest character n-grams used to index names and lemmas for
+# substring search.
+NGRAM = 3
+# Nodes with this property group substitutes for each other as children.
+SUBSTITUTE_PROPERTIES = ['.substitute']
+
+def _wn():
+	# NLTK is imported on first use; it dominates the cost of importing this module.
+	from nltk.corpus import wordnet
+	return wordnet
+
+def _nltk_version():
+	# Read without importing NLTK, so a snapshot can be checked cheaply.
+	try:
+		with open(os.path.join(imp.find_module('nltk')[1], 'VERSION')) as fin:
+			return fin.read().strip()
+	except (ImportError, IOError):
+		return 'unknown'
 
 def _strip_local(prop):
 	if prop.startswith('.'):
@@ -72,13 +97,88 @@ def property_match(prop, plist):
 	A negative property will match a plist if a negative form of that
 	property appears in the plist or no positive form does.
 	"""
-	prop = _strip_pos(prop)
-	plist = [_strip_pos(p) for p in plist]
+	pset = set(_strip_pos(p) for p in plist)
+	query = compile_properties([prop])
+	if query is None:
+		return _property_match(_strip_pos(prop), pset)
+	return _mask_match(_property_mask(pset), query)
+
+def _property_match(prop, pset):
+	# property_match for a prop and a set of properties with + already stripped.
 	if prop.startswith('-'):
-		return prop in plist or (_strip_neg(prop) not in plist and \
-			_make_local(_strip_neg(prop)) not in plist)
+		return prop in pset or (_strip_neg(prop) not in pset and \
+			_make_local(_strip_neg(prop)) not in pset)
 	else:
-		return prop in plist and _make_neg(prop) not in plist
+		return prop in pset and _make_neg(prop) not in pset
+
+# Property sets as bitmasks.  Every property name x is interned to an id i
+# and owns three bits of a mask:
+#	3i     x is in the set and -x isn't (what a query for x needs)
+#	3i + 1 .x is in the set and -x isn't (what a query for .x needs)
+#	3i + 2 either of the above (what a query for -x must not find)
+# so any property list compiles to a (must have, must not have) mask pair
+# and matching a node is two integer tests.  Names that themselves start
+# with +, - or . have no bits; queries mentioning them use the string rules.
+_property_ids = {}
+_property_lock = threading.Lock()
+_compiled_properties = {}
+
+def _property_bit(name, offset):
+	i = _property_ids.get(name)
+	if i is None:
+		with _property_lock:
+			i = _property_ids.setdefault(name, len(_property_ids))
+	return 1 << (3 * i + offset)
+
+def _plain_name(name):
+	return name and name[0] not in '+-.'
+
+def _property_mask(pset):
+	"""The mask of a set of properties with + already stripped."""
+	mask = 0
+	for prop in pset:
+		if prop.startswith('.'):
+			name, offset = prop[1:], 1
+		elif prop.startswith('-'):
+			continue
+		else:
+			name, offset = prop, 0
+		if _plain_name(name) and '-' + name not in pset:
+			mask |= _property_bit(name, offset) | _property_bit(name, 2)
+	return mask
+
+def compile_properties(plist):
+	"""
+	Compile a property list to its (must have, must not have) mask pair,
+	or return None if it can only be matched with the string rules.
+	"""
+	key = tuple(plist)
+	try:
+		return _compiled_properties[key]
+	except KeyError:
+		pass
+	must = must_not = 0
+	for p in plist:
+		prop = _strip_pos(p)
+		if prop.startswith('-'):
+			name, offset = prop[1:], 2
+		elif prop.startswith('.'):
+			name, offset = prop[1:], 1
+		else:
+			name, offset = prop, 0
+		if not _plain_name(name):
+			must = None
+			break
+		if offset == 2:
+			must_not |= _property_bit(name, offset)
+		else:
+			must |= _property_bit(name, offset)
+	query = (must, must_not) if must is not None else None
+	_compiled_properties[key] = query
+	return query
+
+def _mask_match(mask, query):
+	return mask & query[0] == query[0] and not mask & query[1]
 
 def all_properties(node, plist):
 	"""
@@ -92,31 +192,183 @@ def all_properties(node, plist):
 	"""
 	if not plist:
 		return True
-	props = [_strip_pos(p) for p in node.get_properties(local=True)]
-	plist = [_strip_pos(p) for p in plist]
-	return all(property_match(p, props) for p in plist)
+	query = compile_properties(plist)
+	if query is None:
+		props = node.property_set(local=True)
+		return all(_property_match(_strip_pos(p), props) for p in plist)
+	return _mask_match(node.property_mask(local=True), query)
+
+def filter_properties(nodes, plist):
+	"""Return the nodes for which all_properties(node, plist) is True, in order."""
+	return list(iter_filter_properties(nodes, plist))
+
+def iter_filter_properties(nodes, plist):
+	"""Lazy form of filter_properties."""
+	if not plist:
+		return iter(nodes)
+	query = compile_properties(plist)
+	if query is None:
+		return (node for node in nodes if all_properties(node, plist))
+	return (node for node in nodes if _mask_match(node.property_mask(local=True), query))
+
+def _ngrams(s, n=NGRAM):
+	return set(s[i:i + n] for i in range(len(s) - n + 1))
+
+def _rank(key):
+	return (len(key), key)
+
+class SubstringIndex(object):
+	"""
+	The strings added to it, searchable by substring.
+
+	Every character n-gram of each string, from single characters up to
+	NGRAM long, has a postings set, so a query of up to NGRAM characters is
+	one lookup and a longer one intersects its NGRAM-grams' postings and
+	checks the few survivors.  A sorted copy of the strings answers prefix
+	queries by bisection.
+	"""
+
+	def __init__(self):
+		self.keys = set()
+		self._grams = defaultdict(set) # Character n-gram -> keys containing it.
+		self._sorted = None
+
+	def __len__(self):
+		return len(self.keys)
+
+	def add(self, key):
+		if key and key not in self.keys:
+			self.keys.add(key)
+			self._sorted = None
+			for n in range(1, NGRAM + 1):
+				for gram in _ngrams(key, n):
+					self._grams[gram].add(key)
+
+	def containing(self, query):
+		"""Return the set of keys that contain query, which must not be empty."""
+		return set(self.matches(query))
+
+	def matches(self, query):
+		"""Like containing, but may return an internal set, which must not be modified."""
+		if len(query) <= NGRAM:
+			return self._grams.get(query, frozenset())
+		postings = [self._grams.get(gram) for gram in _ngrams(query)]
+		if not all(postings):
+			return set()
+		postings.sort(key=len)
+		return set(key for key in postings[0].intersection(*postings[1:]) if query in key)
+
+	def starting_with(self, query):
+		"""Return the keys that start with query, in sorted order."""
+		if self._sorted is None:
+			self._sorted = sorted(self.keys)
+		keys = self._sorted
+		i = bisect_left(keys, query)
+		j = i
+		while j < len(keys) and keys[j].startswith(query):
+			j += 1
+		return keys[i:j]
+
+	def ranked(self, query):
+		"""
+		Yield the keys containing query, best first: query itself, then
+		keys starting with it, then the rest, each group shortest first and
+		then alphabetically.  Later groups are only looked up if the
+		caller keeps iterating.
+		"""
+		if query in self.keys:
+			yield query
+		prefixed = [key for key in self.starting_with(query) if key != query]
+		prefixed.sort(key=_rank)
+		for key in prefixed:
+			yield key
+		seen = set(prefixed)
+		seen.add(query)
+		rest = [key for key in self.containing(query) if key not in seen]
+		rest.sort(key=_rank)
+		for key in rest:
+			yield key
 
 class Index(dict):
 	def __init__(self):
 		self.lemmas = {}
+		self._name_search = SubstringIndex()
+		self._lemma_search = SubstringIndex()
+		self._lemma_order = None
+
+	def __setitem__(self, name, node):
+		dict.__setitem__(self, name, node)
+		self._name_search.add(name)
+
+	def add_lemma(self, lemma, node):
+		if lemma not in self.lemmas:
+			self.lemmas[lemma] = []
+			self._lemma_order = None
+			self._lemma_search.add(lemma)
+		if node not in self.lemmas[lemma]:
+			self.lemmas[lemma].append(node)
+
+	def lemma_order(self):
+		"""Map each lemma to its position when iterating over self.lemmas."""
+		if self._lemma_order is None:
+			self._lemma_order = dict((lemma, i) for i, lemma in enumerate(self.lemmas))
+		return self._lemma_order
+
+	def lemmas_containing(self, query):
+		"""
+		Return the lemmas that contain query as a substring, in the same
+		order a scan over self.lemmas would find them.
+		"""
+		return list(self.iter_lemmas_containing(query))
+
+	def iter_lemmas_containing(self, query):
+		"""
+		Lazy form of lemmas_containing, so callers that stop at the first
+		usable lemma don't pay for ordering the rest.  Many candidates (as
+		for one- or two-letter queries) are yielded by scanning self.lemmas
+		in order, which finds the first one quickly; a few are sorted.
+		"""
+		if not query:
+			for lemma in self.lemmas:
+				if lemma.find(query) >= 0:
+					yield lemma
+			return
+		candidates = self._lemma_search.matches(query)
+		if len(candidates) ** 2 * 8 > len(self.lemmas): # Scanning to a hit beats sorting.
+			for lemma in self.lemmas:
+				if lemma in candidates:
+					yield lemma
+		else:
+			order = self.lemma_order()
+			for lemma in sorted(candidates, key=order.__getitem__):
+				yield lemma
 
 	def search(self, query=None, n=None, properties=None):
+		"""
+		Return the nodes whose names contain query, ranked as by
+		SubstringIndex.ranked, or every node if there is no query.
+		"""
+		results = self.iter_search(query, properties)
+		return list(islice(results, n) if n else results)
+
+	def search_lemmas(self, query=None, n=None, properties=None):
+		"""Like search, but matching query against lemmas."""
+		results = self.iter_search_lemmas(query, properties)
+		return list(islice(results, n) if n else results)
+
+	def iter_search(self, query=None, properties=None):
 		if query:
-			results = [self[name] for name in self if name.find(query) >= 0]
+			results = (self[name] for name in self._name_search.ranked(query))
 		else:
-			results = self.values()
-		if properties: # List of properties that must be directly on the node.
-			results = [r for r in results if all_properties(r, properties)]
-		return results[:n] if n else results
+			results = self.itervalues()
+		return iter_filter_properties(results, properties)
 
-	def search_lemmas(self, query=None, n=None, properties=None):
+	def iter_search_lemmas(self, query=None, properties=None):
 		if query:
-			results = [node for lemma in self.lemmas if lemma.find(query) >= 0 for node in self.lemmas[lemma]]
+			results = (node for lemma in self._lemma_search.ranked(query) for node in self.lemmas[lemma])
 		else:
-			results = self.values()
-		if properties: # List of properties that must be directly on the node.
-			results = [r for r in results if all_properties(r, properties)]
-		return results[:n] if n else results
+			results = self.itervalues()
+		return iter_filter_properties(results, properties)
 
 	def pick_one(self, query=None, properties=None, fallback=FALLBACK):
 		# If fallback is true, fall back to each word in the query in turn before failing.
@@ -132,8 +384,8 @@ class Index(dict):
 			for result in self.lemmas[query]:
 				if all_properties(result, properties):
 					return result
-		for lemma in self.lemmas:
-			if not lemma.startswith('<') and lemma.find(query) >= 0 and len(self.lemmas[lemma]) > 0:
+		for lemma in self.iter_lemmas_containing(query):
+			if not lemma.startswith('<') and len(self.lemmas[lemma]) > 0:
 				for result in self.lemmas[lemma]:
 					if all_properties(result, properties):
 						return result
@@ -147,7 +399,8 @@ class Index(dict):
 class Node(object):
 	def __init__(self, name=None, synset=None, lemmas=None, properties=None,
 						parents=None, children=None, cancels=None, index=None):
-		self.synset = synset
+		self._synset = synset
+		self._synset_name = None # Set instead of _synset for nodes loaded from a snapshot.
 		self.name = name or (self.synset.name() if self.synset else None)
 
 		# Use assigned index or first index found among parents, then children.
@@ -166,6 +419,8 @@ class Node(object):
 		self.cancels = []
 		self.ancestors = set()
 		self.descendants = set()
+		self._property_cache = {} # local -> (properties, stripped property set, mask)
+		self._substitute_cache = None # Candidate substitutes, in get_substitutes order.
 	
 		if lemmas:
 			self.add_lemmas(lemmas)
@@ -183,6 +438,12 @@ class Node(object):
 		if cancels:
 			self.add_cancels(cancels)
 	
+	@property
+	def synset(self):
+		if self._synset is None and self._synset_name:
+			self._synset = _wn().synset(self._synset_name)
+		return self._synset
+
 	def __str__(self):
 		return '<Node %s>' % self.name
 
@@ -193,13 +454,18 @@ class Node(object):
 		return len(self.index)
 
 	def search(self, query=None, n=None, properties=None):
-		raw_results = self.index.search(query=query, properties=properties) + \
-						self.index.search_lemmas(query=query, properties=properties)
+		# Name matches first, then lemma matches, stopping once n are found.
+		raw_results = chain(self.index.iter_search(query=query, properties=properties),
+							self.index.iter_search_lemmas(query=query, properties=properties))
 		results = []
+		seen = set()
 		for result in raw_results:
-			if result not in results:
+			if result not in seen:
+				seen.add(result)
 				results.append(result)
-		return results[:n] if n else results
+				if n and len(results) >= n:
+					break
+		return results
 
 	def pick_one(self, query=None, properties=None, fallback=FALLBACK):
 		return self.index.pick_one(query=query, properties=properties, fallback=fallback)
@@ -207,10 +473,7 @@ class Node(object):
 	def add_lemma(self, lemma):
 		if lemma not in self.lemmas:
 			self.lemmas.append(lemma)
-		if lemma not in self.index.lemmas:
-			self.index.lemmas[lemma] = []
-		if self not in self.index.lemmas[lemma]:
-			self.index.lemmas[lemma].append(self)
+		self.index.add_lemma(lemma, self)
 
 	def add_lemmas(self, lemmas):
 		for lemma in lemmas:
@@ -219,6 +482,7 @@ class Node(object):
 	def add_property(self, property):
 		if property not in self.properties:
 			self.properties.append(property)
+			self.invalidate_properties()
 
 	def add_properties(self, properties):
 		for property in properties:
@@ -234,6 +498,7 @@ class Node(object):
 			for descendant in self.descendants:
 				descendant.ancestors.add(parent)
 				descendant.ancestors |= parent.ancestors
+			self.invalidate_properties()
 		if self not in parent.children:
 			parent.children.append(self)
 			parent.descendants.add(self)
@@ -241,6 +506,7 @@ class Node(object):
 			for ancestor in parent.ancestors:
 				ancestor.descendants.add(self)
 				ancestor.descendants |= self.descendants
+			parent.invalidate_substitutes()
 
 	def add_parents(self, parents):
 		for parent in parents:
@@ -256,6 +522,7 @@ class Node(object):
 			for ancestor in self.ancestors:
 				ancestor.descendants.add(child)
 				ancestor.descendants |= child.descendants
+			self.invalidate_substitutes()
 		if self not in child.parents:
 			child.parents.append(self)
 			child.ancestors.add(self)
@@ -263,6 +530,7 @@ class Node(object):
 			for descendant in child.descendants:
 				descendant.ancestors.add(self)
 				descendant.ancestors |= self.ancestors
+			child.invalidate_properties()
 
 	def add_children(self, children):
 		for child in children:
@@ -270,9 +538,32 @@ class Node(object):
 
 	def add_cancel(self, cancel):
 		self.cancels.append(cancel)
+		self.invalidate_properties()
 
 	def add_cancels(self, cancels):
 		self.cancels += cancels
+		self.invalidate_properties()
+
+	def invalidate_properties(self):
+		"""
+		Drop the cached properties of this node and everything that inherits
+		from it.  Called whenever its properties, cancels or ancestors change.
+		"""
+		self._property_cache = {}
+		self._substitute_cache = None
+		for descendant in self.descendants:
+			descendant._property_cache = {}
+			descendant._substitute_cache = None
+
+	def invalidate_substitutes(self):
+		"""
+		Drop the cached substitute candidates of this node and its
+		descendants, whose candidates may include its children.  Called
+		whenever its children change.
+		"""
+		self._substitute_cache = None
+		for descendant in self.descendants:
+			descendant._substitute_cache = None
 
 	def walk_descendants(self, fn, before=True, test=False, properties=None):
 		"""
@@ -344,10 +635,33 @@ class Node(object):
 	def has_property(self, property):
 		# There's probably a quicker way to do this with walk_ancestors and test=True.
 		# However, taking +prop and -prop into account makes this nontrivial.
-		# Therefore let's just use get_properties.
-		return property_match(property, self.get_properties())
+		# Therefore let's just use the cached property set.
+		query = compile_properties([property])
+		if query is None:
+			return _property_match(_strip_pos(property), self.property_set())
+		return _mask_match(self.property_mask(), query)
 
 	def get_properties(self, local=False):
+		return list(self._properties(local)[0])
+
+	def property_set(self, local=False):
+		"""Return get_properties(local) as a frozenset with + stripped off."""
+		return self._properties(local)[1]
+
+	def property_mask(self, local=False):
+		"""Return property_set(local) as a mask for compile_properties queries."""
+		return self._properties(local)[2]
+
+	def _properties(self, local):
+		cached = self._property_cache.get(local)
+		if cached is None:
+			properties = self._collect_properties(local)
+			pset = frozenset(_strip_pos(p) for p in properties)
+			cached = (tuple(properties), pset, _property_mask(pset))
+			self._property_cache[local] = cached
+		return cached
+
+	def _collect_properties(self, local):
 		# If local, pretend all positive direct properties are local.
 		if local:
 			properties = [_make_local(p) for p in self.properties if not p.startswith('-')]
@@ -393,20 +707,120 @@ class Node(object):
 
 	def get_substitutes(self, properties=None):
 		"""Find a substitute for this node consistent with the given properties."""
-		sub_nodes = []
-		self.walk_ancestors(lambda n: sub_nodes.append(n), properties=['.substitute'])
-		subs = []
-		for sub_node in sub_nodes:
-			for child in sub_node.children:
-				if child != self and child not in subs and all_properties(child, properties):
-					subs.append(child)
-		return subs
+		return filter_properties(self.substitute_candidates(), properties)
+
+	def substitute_candidates(self):
+		"""
+		Return every possible substitute for this node: the children of each
+		.substitute node among itself and its ancestors, in walk order,
+		without repeats or the node itself.  Computed once and cached until
+		the graph around the node changes; filtering the candidates by
+		property only needs their own cached property sets.
+		"""
+		if self._substitute_cache is None:
+			sub_nodes = []
+			self.walk_ancestors(sub_nodes.append, properties=SUBSTITUTE_PROPERTIES)
+			seen = set([self])
+			candidates = []
+			for sub_node in sub_nodes:
+				for child in sub_node.children:
+					if child not in seen:
+						seen.add(child)
+						candidates.append(child)
+			self._substitute_cache = tuple(candidates)
+		return self._substitute_cache
+
+class GraphBuilder(object):
+	"""
+	Collects parent-child edges and adds them to the graph all at once.
+
+	Adding edges one at a time with add_parent or add_child updates the
+	ancestors and descendants of every affected node on each insertion.
+	build() instead links all the edges, checks the result for cycles once,
+	and recomputes the closures in a single pass over a topological order.
+	If the new edges would create a cycle, it falls back to adding them one
+	by one, which drops exactly the edges add_parent would have dropped.
+	"""
+
+	def __init__(self):
+		self.edges = []
 
-def wn_subgraph(synsets, max_depth=-1, index=None, toplevel=True):
+	def add_edge(self, parent, child):
+		self.edges.append((parent, child))
+
+	def add_children(self, parent, children):
+		for child in children:
+			self.add_edge(parent, child)
+
+	def build(self):
+		edges, self.edges = self.edges, []
+		linked = []
+		for parent, child in edges:
+			if parent is child:
+				continue
+			added_child = child not in parent.children
+			added_parent = parent not in child.parents
+			if added_child:
+				parent.children.append(child)
+			if added_parent:
+				child.parents.append(parent)
+			if added_child or added_parent:
+				linked.append((parent, child, added_child, added_parent))
+		if not linked:
+			return
+
+		# Every node connected to a new edge may have new ancestors or descendants.
+		region = set()
+		queue = [node for parent, child, _, _ in linked for node in (parent, child)]
+		while queue:
+			node = queue.pop()
+			if node not in region:
+				region.add(node)
+				queue += node.parents
+				queue += node.children
+
+		order = _topological_order(region)
+		if order is None:
+			for parent, child, added_child, added_parent in reversed(linked):
+				if added_child:
+					parent.children.remove(child)
+				if added_parent:
+					child.parents.remove(parent)
+			for parent, child in edges:
+				child.add_parent(parent)
+			return
+
+		for node in order:
+			node.ancestors = set()
+			for parent in node.parents:
+				node.ancestors.add(parent)
+				node.ancestors |= parent.ancestors
+		for node in reversed(order):
+			node.descendants = set()
+			for child in node.children:
+				node.descendants.add(child)
+				node.descendants |= child.descendants
+		for node in order:
+			node._property_cache = {}
+			node._substitute_cache = None
+
+def _topological_order(nodes):
+	"""Order nodes so parents come before children, or return None on a cycle."""
+	pending = dict((node, len(node.parents)) for node in nodes)
+	order = [node for node in nodes if not pending[node]]
+	for node in order: # order grows as nodes become ready.
+		for child in node.children:
+			pending[child] -= 1
+			if not pending[child]:
+				order.append(child)
+	return order if len(order) == len(pending) else None
+
+def wn_subgraph(synsets, max_depth=-1, index=None, toplevel=True, builder=None):
 	"""
 	Given a list of WordNet synsets, construct a Graph of Nodes corresponding
 	to all the hyponyms of those synsets up to max_depth.  A negative max_depth
-	means the depth is unbounded.  index and toplevel are used internally.
+	means the depth is unbounded.  index, toplevel and builder are used
+	internally.
 	
 	Returns the root of the graph if toplevel if True, otherwise returns the
 	nodes corresponding to each synset given.
@@ -414,6 +828,7 @@ def wn_subgraph(synsets, max_depth=-1, index=None, toplevel=True):
 
 	# Initial setup.
 	index = index or Index()
+	builder = builder or GraphBuilder()
 	roots = [index[synset.name()] if synset.name() in index else\
 				Node(synset=synset, index=index) for synset in synsets]
 
@@ -421,19 +836,22 @@ def wn_subgraph(synsets, max_depth=-1, index=None, toplevel=True):
 	if max_depth != 0:
 		for root in roots:
 			hyps = root.synset.hyponyms()
-			children = wn_subgraph(hyps, max_depth=max_depth-1, index=index, toplevel=False)
-			root.add_children(children)
+			children = wn_subgraph(hyps, max_depth=max_depth-1, index=index, toplevel=False, builder=builder)
+			builder.add_children(root, children)
 
 	# Make any other connections needed using the populated index.
 	if toplevel: # Only do this once.
-		root = Node(name='<root>', index=index, children=roots)
+		root = Node(name='<root>', index=index)
+		builder.add_children(root, roots)
+		builder.build()
 		def connect_parents(node):
 			if node.synset:
 				for hyp in node.synset.hypernyms():
 					# We only care about synsets that are part of the subgraph.
 					if hyp.name() in index:
-						index[hyp.name()].add_child(node)
+						builder.add_edge(index[hyp.name()], node)
 		root.walk_descendants(connect_parents)
+		builder.build()
 		return root
 	# Return the roots if not toplevel.
 	return roots
@@ -470,6 +888,7 @@ def read_category_files(files, graph=None):
 	Return either the original graph or a root node for the new graph.
 	"""
 	index = graph.index if graph else Index()
+	builder = GraphBuilder()
 	roots = []
 	for file in files:
 		for category, members in loadCategorization(file).iteritems():
@@ -478,8 +897,12 @@ def read_category_files(files, graph=None):
 			roots.append(root)
 			for member in members:
 				child = index.pick_one(member) or Node(name=member, index=index)
-				child.add_parent(root)
-	return graph if graph else Node(name='<root>', index=index, children=roots)
+				builder.add_edge(root, child)
+	if not graph:
+		graph = Node(name='<root>', index=index)
+		builder.add_children(graph, roots)
+	builder.build()
+	return graph
 
 def read_substitute_files(files, graph=None):
 	"""
@@ -490,6 +913,7 @@ def read_substitute_files(files, graph=None):
 	Return either the original graph or a root node for the new graph.
 	"""
 	index = graph.index if graph else Index()
+	builder = GraphBuilder()
 	roots = []
 	for file in files:
 		for category, members in loadCategorization(file).iteritems():
@@ -497,12 +921,35 @@ def read_substitute_files(files, graph=None):
 			base = index.pick_one(category) or Node(name=category, index=index)
 			name = '<' + category + ' substitutes>'
 			root = index.pick_one(name) or Node(name=name, index=index, properties=['.substitute'])
-			root.add_child(base)
+			builder.add_edge(root, base)
 			roots.append(root)
 			for member in members:
 				child = index.pick_one(member) or Node(name=member, index=index)
-				child.add_parent(root)
-	return graph if graph else Node(name='<root>', index=index, children=roots)
+				builder.add_edge(root, child)
+	if not graph:
+		graph = Node(name='<root>', index=index)
+		builder.add_children(graph, roots)
+	builder.build()
+	return graph
+
+def build_substitute_index(root):
+	"""
+	Compute substitute_candidates() for every node in the graph containing
+	root that doesn't already have them cached, so lookups never walk the
+	graph.  After the graph changes, calling this again only recomputes the
+	nodes whose candidates were invalidated.  Return the number computed.
+	"""
+	nodes = set([root]) | root.descendants | set(root.index.values())
+	sub_nodes = set(node for node in nodes if all_properties(node, SUBSTITUTE_PROPERTIES))
+	computed = 0
+	for node in nodes:
+		if node._substitute_cache is None:
+			if node in sub_nodes or not sub_nodes.isdisjoint(node.ancestors):
+				node.substitute_candidates()
+			else:
+				node._substitute_cache = () # Nothing to walk up to.
+			computed += 1
+	return computed
 
 def read_property_files(files, graph, signal=False):
 	"""
@@ -547,7 +994,139 @@ def read_synonym_files(files, graph, signal=False):
 					sys.stderr.write('Warning: Node %s created with lemmas %s.\n' % (category, lemmas))
 	return graph
 
-def food_graph(cats=CATEGORY_FILES, subs=SUBSTITUTE_FILES, props=PROPERTIES_FILES, syns=SYNONYM_FILES):
+# Snapshots of the finished graph, so food_graph() can skip the WordNet walk.
+# A snapshot is keyed by a hash of its input files; any change to them (or to
+# SNAPSHOT_VERSION) makes food_graph() rebuild and rewrite it.
+SNAPSHOT_FILE = os.path.join(os.environ.get('GRAPH_CACHE_DIR', '.graph_cache'), 'food_graph.snapshot')
+SNAPSHOT_MAGIC = 'FOODGRAPH'
+SNAPSHOT_VERSION = 1
+
+def snapshot_key(files):
+	"""Hash the snapshot format, the NLTK version and the contents of files."""
+	h = hashlib.sha1('%s:%s:%s' % (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, _nltk_version()))
+	for file in files:
+		h.update('\0' + file + '\0')
+		with open(file, 'rb') as fin:
+			h.update(fin.read())
+	return h.hexdigest()
+
+def graph_tables(root):
+	"""
+	Flatten the graph containing root into tables keyed by integer node id:
+	per-node names, synset names, lemmas and properties, the parent, child,
+	cancel, ancestor and descendant edges as lists of ids, and the index's
+	name and lemma entries.
+	"""
+	index = root.index
+	found = set([root]) | set(index.values())
+	for lemma_nodes in index.lemmas.itervalues():
+		found.update(lemma_nodes)
+	queue = list(found)
+	while queue:
+		node = queue.pop()
+		for other in node.parents + node.children + node.cancels:
+			if other not in found:
+				found.add(other)
+				queue.append(other)
+	nodes = sorted(found, key=lambda n: n.name)
+	ids = dict((node, i) for i, node in enumerate(nodes))
+	def refs(collection):
+		return sorted(ids[n] for n in collection)
+	tables = {
+		'root': ids[root],
+		'index': [(name, ids[node]) for name, node in index.iteritems()],
+		'index_lemmas': [(lemma, [ids[n] for n in lemma_nodes]) for lemma, lemma_nodes in index.lemmas.iteritems()],
+		'names': [n.name for n in nodes],
+		'synsets': [n._synset_name or (n._synset.name() if n._synset else None) for n in nodes],
+		'lemmas': [list(n.lemmas) for n in nodes],
+		'properties': [list(n.properties) for n in nodes],
+		'parents': [[ids[p] for p in n.parents] for n in nodes],
+		'children': [[ids[c] for c in n.children] for n in nodes],
+		'cancels': [[ids[c] for c in n.cancels] for n in nodes],
+		'ancestors': [refs(n.ancestors) for n in nodes],
+		'descendants': [refs(n.descendants) for n in nodes],
+	}
+	return tables
+
+def save_snapshot(root, file, key):
+	"""
+	Write the graph containing root to file: a header line followed by
+	one marshal record of graph_tables(root).  It is written atomically.
+	"""
+	tables = graph_tables(root)
+	directory = os.path.dirname(file)
+	if directory and not os.path.isdir(directory):
+		os.makedirs(directory)
+	tmp = '%s.%d.tmp' % (file, os.getpid())
+	with open(tmp, 'wb') as fout:
+		fout.write('%s %d %s\n' % (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, key))
+		marshal.dump(tables, fout)
+	os.rename(tmp, file)
+
+def read_snapshot_tables(file, key):
+	"""
+	Return the tables stored in a snapshot, or None if file is missing or
+	was built from different inputs.
+	"""
+	try:
+		fin = open(file, 'rb')
+	except IOError:
+		return None
+	with fin:
+		if fin.readline().rstrip('\n') != '%s %d %s' % (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, key):
+			return None
+		return marshal.load(fin)
+
+def load_snapshot(file, key):
+	"""
+	Rebuild a graph from a snapshot written by save_snapshot.
+
+	Returns the root node, or None if there is no usable snapshot.
+	"""
+	tables = read_snapshot_tables(file, key)
+	if tables is None:
+		return None
+	index = Index()
+	nodes = []
+	for name, synset_name, lemmas, properties in zip(tables['names'], tables['synsets'],
+														tables['lemmas'], tables['properties']):
+		node = Node.__new__(Node)
+		node._synset = None
+		node._synset_name = synset_name
+		node.name = name
+		node.index = index
+		node.lemmas = lemmas
+		node.properties = properties
+		node._property_cache = {}
+		node._substitute_cache = None
+		nodes.append(node)
+	for name, i in tables['index']:
+		index[name] = nodes[i]
+	for lemma, lemma_ids in tables['index_lemmas']:
+		for i in lemma_ids:
+			index.add_lemma(lemma, nodes[i])
+	for i, node in enumerate(nodes):
+		node.parents = [nodes[j] for j in tables['parents'][i]]
+		node.children = [nodes[j] for j in tables['children'][i]]
+		node.cancels = [nodes[j] for j in tables['cancels'][i]]
+		node.ancestors = set(nodes[j] for j in tables['ancestors'][i])
+		node.descendants = set(nodes[j] for j in tables['descendants'][i])
+	return nodes[tables['root']]
+
+def food_graph(cats=CATEGORY_FILES, subs=SUBSTITUTE_FILES, props=PROPERTIES_FILES, syns=SYNONYM_FILES,
+				snapshot=SNAPSHOT_FILE):
+	"""
+	Build the food graph, or load it from snapshot if one exists for the
+	same input files.  A freshly built graph is saved to snapshot.
+	Pass snapshot=None to always build from scratch.
+	"""
+	if snapshot:
+		key = snapshot_key(cats + subs + props + syns)
+		root = load_snapshot(snapshot, key)
+		if root:
+			build_substitute_index(root)
+			return root
+	wn = _wn()
 	root = wn_subgraph([wn.synset('food.n.01'), wn.synset('food.n.02')])
 	if cats:
 		read_category_files(cats, graph=root)
@@ -557,4 +1136,10 @@ def food_graph(cats=CATEGORY_FILES, subs=SUBSTITUTE_FILES, props=PROPERTIES_FILE
 		read_property_files(props, root, signal=True)
 	if syns:
 		read_synonym_files(syns, root, signal=True)
+	if snapshot:
+		try:
+			save_snapshot(root, snapshot, key)
+		except (IOError, OSError) as e:
+			sys.stderr.write('Warning: could not save graph snapshot %s: %s\n' % (snapshot, e))
+	build_substitute_index(root)
 	return root
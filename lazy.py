@@ -0,0 +1,85 @@
+# lazy.py
+# Expensive shared state (the food graph, the POS tagger, the lexicons),
+# loaded on first use and optionally warmed up in the background.
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+class Component(object):
+    """
+    A named value built by loader the first time get() is called.
+
+    Concurrent callers block until the single load finishes.  If the load
+    fails, the error propagates and the next get() tries again.
+
+    If the value is a singleton that the code also reaches without going
+    through get(), probe() should return True once it exists, so status()
+    and ready() report it however it was loaded.
+    """
+
+    def __init__(self, name, loader, probe=None):
+        self.name = name
+        self.loader = loader
+        self.probe = probe
+        self.value = None
+        self.loaded = False
+        self.seconds = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.loaded:
+            return self.value
+        with self._lock:
+            if not self.loaded:
+                start = time.time()
+                try:
+                    self.value = self.loader()
+                except Exception as e:
+                    self.error = '%s: %s' % (type(e).__name__, e)
+                    raise
+                self.seconds = time.time() - start
+                self.error = None
+                self.loaded = True
+        return self.value
+
+    def is_loaded(self):
+        return self.loaded or bool(self.probe and self.probe())
+
+    def status(self):
+        return {'loaded': self.is_loaded(), 'seconds': self.seconds, 'error': self.error}
+
+components = OrderedDict()
+
+def register(name, loader, probe=None):
+    """Register loader under name and return its Component."""
+    component = components[name] = Component(name, loader, probe)
+    return component
+
+def status():
+    """Return the load status of every registered component, by name."""
+    return OrderedDict((name, component.status()) for name, component in components.iteritems())
+
+def ready():
+    return all(component.is_loaded() for component in components.itervalues())
+
+def warm_up(names=None, background=True):
+    """
+    Load the named components (all of them by default) in registration
+    order.  If background, do it on a daemon thread and return the thread.
+    """
+    def run():
+        for name in names or list(components):
+            try:
+                components[name].get()
+            except Exception as e:
+                sys.stderr.write('Warning: could not load %s: %s\n' % (name, e))
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name='warm-up')
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,148 @@
+# lexicon.py
+# Word lists used by the recipe parser, loaded once and shared read-only.
+
+import threading
+
+UNITS_FILE = "resources/units.txt"
+TOOLS_FILE = "resources/tools.txt"
+METHODS_FILE = "resources/methods.txt"
+
+# Verbs that imply a tool even when the tool itself is never mentioned.
+VERB_TOOL = {
+  'heat':'oven',
+  'fry':'pan',
+  'chop':'knife',
+  'cut':'knife',
+  'julienne':'knife',
+  'mince':'knife',
+  'dice':'knife',
+  'minced':'knife',
+  'slice':'knife',
+  'stir':'spoon',
+  'fold':'spoon',
+  'glaze':'spoon',
+  'drizzle':'spoon',
+  'baste':'baster',
+  'sift':'colander',
+  'cream':'hand mixer',
+  'grate':'grater',
+  'whisk':'whisk',
+  'marinate':'bowl',
+  'shred':'food processor',
+  'peel':'peeler',
+}
+
+#http://www.recipetips.com/kitchen-tips/t--482/units-of-measure.asp
+UNIT_ABBREVIATION = {
+    'qt': 'quart',
+    't': 'teaspoon',
+    'tsp':'teaspoon',
+    'c':'cup',
+    'oz':'ounce',
+    'pt': 'pint',
+    'gal':'gallon',
+    'lb':'pound'
+}
+
+
+class FrozenDict(dict):
+    """A dict that refuses to be modified after construction."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('%s is read-only' % type(self).__name__)
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        return hash(frozenset(self.iteritems()))
+
+
+def _read_lines(path, encoding=None):
+    """Return the lines of path in file order, without duplicates."""
+    seen = set()
+    lines = []
+    with open(path) as fin:
+        for line in fin:
+            line = line.rstrip('\n')
+            if encoding:
+                line = unicode(line, encoding)
+            if line not in seen:
+                seen.add(line)
+                lines.append(line)
+    return tuple(lines)
+
+
+class Lexicon(object):
+    """
+    Immutable bundle of the units, tools and methods word lists.
+
+    Ordered tuples keep the file order for iteration; the matching
+    frozensets answer membership tests.  A Lexicon is never modified
+    after construction, so one instance can be shared freely between
+    threads and (after a fork) between processes.
+    """
+    __slots__ = ('units', 'tools', 'methods', 'unit_set', 'tool_set',
+                 'method_set', 'verb_tool', 'unit_abbreviation')
+
+    def __init__(self, units, tools, methods, verb_tool=VERB_TOOL,
+                 unit_abbreviation=UNIT_ABBREVIATION):
+        set_ = object.__setattr__
+        set_(self, 'units', tuple(units))
+        set_(self, 'tools', tuple(tools))
+        set_(self, 'methods', tuple(methods))
+        set_(self, 'unit_set', frozenset(self.units))
+        set_(self, 'tool_set', frozenset(self.tools))
+        set_(self, 'method_set', frozenset(self.methods))
+        set_(self, 'verb_tool', FrozenDict(verb_tool))
+        set_(self, 'unit_abbreviation', FrozenDict(unit_abbreviation))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Lexicon is read-only')
+
+    def __repr__(self):
+        return '<Lexicon %d units, %d tools, %d methods>' % \
+            (len(self.units), len(self.tools), len(self.methods))
+
+    def normalize_unit(self, word):
+        """Expand a unit abbreviation, leaving other words untouched."""
+        return self.unit_abbreviation.get(word, word)
+
+
+def load_lexicon(units_file=UNITS_FILE, tools_file=TOOLS_FILE,
+                 methods_file=METHODS_FILE):
+    return Lexicon(_read_lines(units_file, 'utf-8'),
+                   _read_lines(tools_file),
+                   _read_lines(methods_file))
+
+
+_lexicon = None
+_lock = threading.Lock()
+
+def get_lexicon():
+    """Return the shared Lexicon, loading it on first use."""
+    global _lexicon
+    lexicon = _lexicon
+    if lexicon is None:
+        with _lock:
+            if _lexicon is None:
+                _lexicon = load_lexicon()
+            lexicon = _lexicon
+    return lexicon
+
+def lexicon_loaded():
+    return _lexicon is not None
+
+def reload_lexicon(**files):
+    """
+    Re-read the word lists and atomically replace the shared Lexicon.
+
+    Keyword arguments are passed to load_lexicon, so a different set of
+    files can be swapped in.  Callers holding the previous Lexicon keep
+    a consistent (if stale) view until they fetch it again.
+    """
+    global _lexicon
+    lexicon = load_lexicon(**files)
+    with _lock:
+        _lexicon = lexicon
+    return lexicon
@@ -1,7 +1,14 @@
 from recipe import *
+import lazy
+import metrics
+import profiling
+from cache import LRUCache
 from flask import Flask, request, session, g, redirect, url_for, \
-		 abort, render_template, flash, jsonify
+		 abort, render_template, flash, jsonify, Response, stream_with_context
 import json
+import time
+import threading
+from multiprocessing.pool import ThreadPool
 from jinja2 import Environment, FileSystemLoader
 import os
 from copy import deepcopy
@@ -14,18 +21,74 @@ SECRET_KEY = 'development key'
 USERNAME = 'admin'
 PASSWORD = 'default'
 
+# Load the graph, tagger and word lists in the background at startup
+# instead of during the first request.  Set WARM_UP=0 to disable.
+WARM_UP = os.environ.get('WARM_UP', '1') not in ('', '0', 'false')
+
+# Parsed recipes, keyed by URL, and finished /fetchRecipe responses, keyed by
+# URL, transforms, graph version and seed.  TTLs are in seconds.
+RECIPE_CACHE_SIZE = 256
+RECIPE_CACHE_TTL = 60 * 60
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 60 * 60
+
+# Threads shared by all /fetchRecipes batches, and the most URLs in one batch.
+BATCH_WORKERS = 8
+BATCH_MAX_URLS = 200
+
+# Add a Server-Timing header with the per-stage breakdown to every response.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '') not in ('', '0', 'false')
+
+# Allow /fetchRecipe?profile=1 (or an X-Profile: 1 header) to run the request
+# under the profiler and return the report.  Reports are also saved under
+# PROFILE_DIR if it is set.
+PROFILING = os.environ.get('PROFILING', '') not in ('', '0', 'false')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+
 # create our little application :)
 app = Flask(__name__)
 app.config.from_object(__name__)
 
-# Routes
-@app.route('/')
-def show_vanilla_home():
-	return render_template('index.html')
+recipe_cache = LRUCache(app.config['RECIPE_CACHE_SIZE'], ttl=app.config['RECIPE_CACHE_TTL'])
+result_cache = LRUCache(app.config['RESULT_CACHE_SIZE'], ttl=app.config['RESULT_CACHE_TTL'])
 
-@app.route('/fetchRecipe', methods=['POST'])
-def fetchRecipe():
-	data = json.loads(request.data)
+REQUESTS = metrics.Counter('recipe_requests_total', 'HTTP requests by endpoint and status.', ['endpoint', 'status'])
+REQUEST_ERRORS = metrics.Counter('recipe_request_errors_total', 'Requests that raised an exception.', ['endpoint'])
+REQUEST_SECONDS = metrics.Histogram('recipe_request_seconds', 'Time to produce a response, by endpoint.', ['endpoint'])
+
+def _caches():
+	return [('recipes', recipe_cache), ('results', result_cache), ('ingredients', ingredient_cache),
+			('substitution_patterns', substitution_patterns), ('pages', pagecache.page_cache)]
+
+def _cache_metric(stat):
+	def collect():
+		return [((name,), cache.stats()[stat]) for name, cache in _caches() if stat in cache.stats()]
+	return collect
+
+metrics.CallbackMetric('recipe_cache_hits_total', 'Cache hits.', 'counter', ['cache'], _cache_metric('hits'))
+metrics.CallbackMetric('recipe_cache_misses_total', 'Cache misses.', 'counter', ['cache'], _cache_metric('misses'))
+metrics.CallbackMetric('recipe_cache_evictions_total', 'Entries evicted to stay under maxsize.', 'counter', ['cache'], _cache_metric('evictions'))
+metrics.CallbackMetric('recipe_cache_size', 'Entries currently cached.', 'gauge', ['cache'], _cache_metric('size'))
+metrics.CallbackMetric('recipe_upstream_bytes_total', 'Page bytes downloaded from recipe sites.', 'counter', [],
+					   lambda: [((), pagecache.page_cache.stats()['bytes_fetched'])])
+
+def get_recipe(url):
+	"""Return the parsed recipe at url, from recipe_cache if possible.  Don't modify it."""
+	recipe = recipe_cache.get(url)
+	if recipe is None:
+		recipe = fetch_recipe(url)
+		recipe_cache.put(url, recipe)
+	return recipe
+
+def transform_stages(data, fetch=get_recipe):
+	"""
+	Fetch the recipe at data['url'] and apply the transforms data asks for,
+	yielding (stage, recipe) as each step finishes: first ('old', parsed
+	recipe), then ('cuisine', ...), ('health', ...) and ('veg', ...) for the
+	transforms requested.  Transforms build on each other, and each one
+	edits the recipe yielded before it in place, so serialize as you go.
+	fetch(url) returns the parsed recipe, which must not be modified.
+	"""
 	recipe_url = None 
 	veg_transform = None
 	cuisine_transform = None
@@ -34,27 +97,195 @@ def fetchRecipe():
 	if 'url' in data:
 		recipe_url = data["url"]
 
-	recipe = fetch_recipe(recipe_url)
-	old = deepcopy(recipe)
+	old = fetch(recipe_url)
+	yield 'old', old
+	recipe = deepcopy(old)
+	rng = random.Random(data['seed']) if data.get('seed') is not None else random
 
 	if 'cuisine' in data:
 		cuisine_transform = data["cuisine"]
-		recipe = replaceIngredients(recipe, convertCuisine(recipe, cuisine_transform))
+		recipe = replaceIngredients(recipe, convertCuisine(recipe, cuisine_transform), rng)
+		yield 'cuisine', recipe
 
 	if 'health' in data:
 		health_transform = data["health"]
-		recipe = replaceIngredients(recipe, convertCuisine(recipe, health_transform))
+		recipe = replaceIngredients(recipe, convertCuisine(recipe, health_transform), rng)
+		yield 'health', recipe
 
 	if 'veg' in data:
-		recipe = replaceIngredients(recipe, makeVegetarian(recipe))
+		recipe = replaceIngredients(recipe, makeVegetarian(recipe), rng)
+		yield 'veg', recipe
 
+def transform_recipe(data, fetch=get_recipe):
+	"""
+	Fetch the recipe at data['url'] and apply the transforms data asks for.
+	Return the {'old': ..., 'new': ...} response.
+	"""
 	ret = {}
-	ret['old'] = old
-	ret['new'] = recipe
+	for stage, recipe in transform_stages(data, fetch):
+		ret['old' if stage == 'old' else 'new'] = recipe
+	if 'new' not in ret:
+		ret['new'] = deepcopy(ret['old'])
+	return ret
+
+def result_key(data):
+	# transform_stages tests for the keys, so {"cuisine": null} (convert to the
+	# default profile) must not share a key with no "cuisine" at all.
+	return (data.get('url'), 'cuisine' in data, data.get('cuisine'), 'health' in data, data.get('health'),
+			'veg' in data, graph_version(), json.dumps(data.get('seed')))
+
+def cached_result(data):
+	"""Return the JSON body for transform_recipe(data), from result_cache if possible."""
+	key = result_key(data)
+	body = result_cache.get(key)
+	if body is None:
+		body = json.dumps(transform_recipe(data))
+		result_cache.put(key, body)
+	return body
+
+_batch_pool = []
+_batch_pool_lock = threading.Lock()
+
+def batch_pool():
+	# Created on first use, so that it is never inherited across a fork.
+	with _batch_pool_lock:
+		if not _batch_pool:
+			_batch_pool.append(ThreadPool(app.config['BATCH_WORKERS']))
+		return _batch_pool[0]
+
+def _batch_item(args):
+	index, data = args
+	try:
+		body = cached_result(data)
+	except Exception as e:
+		return json.dumps({'index': index, 'url': data.get('url'), 'error': '%s: %s' % (type(e).__name__, e)})
+	return '{"index": %d, "url": %s, "result": %s}' % (index, json.dumps(data.get('url')), body)
 
+@app.before_request
+def start_request():
+	g.request_start = time.time()
+	metrics.start_trace()
+
+@app.after_request
+def finish_request(response):
+	seconds = time.time() - g.request_start
+	endpoint = request.endpoint or 'none'
+	REQUESTS.inc((endpoint, str(response.status_code)))
+	REQUEST_SECONDS.observe(seconds, (endpoint,))
+	stages = metrics.end_trace()
+	if app.config['SERVER_TIMING']:
+		stages['total'] = seconds
+		response.headers['Server-Timing'] = metrics.server_timing(stages)
+	return response
+
+@app.teardown_request
+def count_error(exc):
+	if exc is not None:
+		REQUEST_ERRORS.inc((request.endpoint or 'none',))
+
+# Routes
+@app.route('/')
+def show_vanilla_home():
+	return render_template('index.html')
+
+@app.route('/fetchRecipe', methods=['POST'])
+def fetchRecipe():
+	# Without a seed, substitutes are picked at random once and the pick
+	# is reused for as long as the result stays cached.
+	data = json.loads(request.data)
+	if app.config['PROFILING'] and (request.args.get('profile') or request.headers.get('X-Profile')):
+		return profiled_result(data)
+	return app.response_class(cached_result(data), mimetype='application/json')
+
+def profiled_result(data):
+	"""
+	transform_recipe(data) under the profiler, skipping the recipe and result
+	caches so the fetch and parse are measured too.  The response gains a
+	'profile' key with cumulative stats and collapsed stacks.
+	"""
+	ret, report = profiling.profile_call(transform_recipe, data, fetch=fetch_recipe)
+	ret['profile'] = report.as_dict()
+	if app.config['PROFILE_DIR']:
+		name = 'fetchRecipe-%d' % int(time.time() * 1000)
+		ret['profile']['files'] = report.save(app.config['PROFILE_DIR'], name)
 	return jsonify(ret)
 
-	
+@app.route('/streamRecipe', methods=['POST'])
+def streamRecipe():
+	"""
+	/fetchRecipe, streamed as newline-delimited JSON so the page can show the
+	original recipe before the transforms finish.  One {"stage", "recipe"}
+	line is written for 'old' and for each transform as it completes (or one
+	'new' line if the result is already cached), then {"stage": "done"}, or
+	{"stage": "error", "error"} if something fails.
+	"""
+	data = json.loads(request.data)
+	key = result_key(data)
+	def line(ret):
+		return json.dumps(ret) + '\n'
+	def generate():
+		body = result_cache.get(key)
+		if body is not None:
+			ret = json.loads(body)
+			yield line({'stage': 'old', 'recipe': ret['old']})
+			yield line({'stage': 'new', 'recipe': ret['new']})
+			yield line({'stage': 'done'})
+			return
+		ret = {}
+		try:
+			for stage, recipe in transform_stages(data):
+				chunk = line({'stage': stage, 'recipe': recipe})
+				ret['old' if stage == 'old' else 'new'] = recipe
+				yield chunk
+		except Exception as e:
+			yield line({'stage': 'error', 'error': '%s: %s' % (type(e).__name__, e)})
+			return
+		if 'new' not in ret:
+			ret['new'] = ret['old']
+		result_cache.put(key, json.dumps(ret))
+		yield line({'stage': 'done'})
+	return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/fetchRecipes', methods=['POST'])
+def fetchRecipes():
+	"""
+	Transform a batch of recipes: {"urls": [...]} plus the same options as
+	/fetchRecipe.  Each recipe is processed on the shared batch pool and
+	written out as one line of newline-delimited JSON as soon as it is done,
+	either {"index", "url", "result": {"old", "new"}} or {"index", "url",
+	"error"}.  Lines arrive in completion order, not request order.
+	"""
+	data = json.loads(request.data)
+	urls = data.get('urls') or []
+	if len(urls) > app.config['BATCH_MAX_URLS']:
+		return jsonify({'error': 'at most %d urls per batch' % app.config['BATCH_MAX_URLS']}), 400
+	options = dict((k, v) for k, v in data.iteritems() if k != 'urls')
+	items = [(i, dict(options, url=url)) for i, url in enumerate(urls)]
+	def generate():
+		for line in batch_pool().imap_unordered(_batch_item, items):
+			yield line + '\n'
+	return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/cacheStats')
+def cacheStats():
+	ret = {
+		'recipes': recipe_cache.stats(),
+		'results': result_cache.stats(),
+		'ingredients': ingredient_cache.stats(),
+		'pages': pagecache.page_cache.stats(),
+	}
+	return jsonify(ret)
+
+@app.route('/metrics')
+def show_metrics():
+	return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def ready():
+	# Which of the heavy components have loaded; 503 until all of them have.
+	ret = {'ready': lazy.ready(), 'components': lazy.status()}
+	return jsonify(ret), 200 if ret['ready'] else 503
+
 # Error Handlers
 @app.errorhandler(500)
 def internal_error(error):
@@ -66,5 +297,9 @@ def not_found(error):
 
 
 if __name__ == '__main__':
-		#app.run(host=os.getenv('IP', '0.0.0.0'),port=int(os.getenv('PORT', 8080)))
+	# The development server; serve.py runs the app with multiple workers.
+	# Under the debug reloader, only warm up in the child that serves requests.
+	if WARM_UP and (not app.debug or os.environ.get('WERKZEUG_RUN_MAIN')):
+		lazy.warm_up()
+	#app.run(host=os.getenv('IP', '0.0.0.0'),port=int(os.getenv('PORT', 8080)))
 	app.run(debug=True)
@@ -0,0 +1,117 @@
+# matcher.py
+# A compiled token trie for finding tools, methods and tool-implying verbs
+# in recipe directions in a single pass.
+
+import threading
+from collections import namedtuple
+from lexicon import get_lexicon
+
+TOOL = 'tool'
+METHOD = 'method'
+VERB_TOOL = 'verb_tool'
+
+# kind is one of TOOL, METHOD or VERB_TOOL.
+# lemma is the lexicon entry matched (for VERB_TOOL, the implied tool).
+# form is the inflected surface form when one was matched, otherwise None.
+# start and end delimit the matched tokens.
+Match = namedtuple('Match', 'kind lemma form start end')
+
+_END = None # Trie key marking the payloads of a complete entry.
+
+def inflections(word):
+    """
+    Return the inflected forms of a verb that should map back to it.
+
+    Covers -ing, -s, -er and -ed, plus the drop-e variants (bake -> baking,
+    baked, baker).
+    """
+    forms = [word + 'ing', word + 's', word + 'er', word + 'ed']
+    if word.endswith('e'):
+        forms += [word[:-1] + 'ing', word + 'd', word + 'r']
+    return forms
+
+def _split(entry):
+    return tuple(entry.replace('-', ' ').split())
+
+
+class Matcher(object):
+    """
+    Token trie compiled from a Lexicon.
+
+    Every tool, method and verb_tool key is inserted as a token sequence.
+    Methods and verbs are also inserted under each of their inflections
+    (applied to the last token), so inflected forms resolve straight to
+    their lemma without building variants at match time.
+    """
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+        self._root = {}
+        for tool in lexicon.tools:
+            self._insert(_split(tool), (TOOL, tool, None))
+        for method in lexicon.methods:
+            self._insert_inflected(method, METHOD, method)
+        for verb, tool in sorted(lexicon.verb_tool.iteritems()):
+            self._insert_inflected(verb, VERB_TOOL, tool)
+
+    def _insert(self, tokens, payload):
+        if not tokens:
+            return
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        payloads = node.setdefault(_END, [])
+        if payload not in payloads:
+            payloads.append(payload)
+
+    def _insert_inflected(self, entry, kind, lemma):
+        tokens = _split(entry)
+        if not tokens:
+            return
+        self._insert(tokens, (kind, lemma, None))
+        for form in inflections(tokens[-1]):
+            inflected = tokens[:-1] + (form,)
+            self._insert(inflected, (kind, lemma, ' '.join(inflected)))
+
+    def scan(self, tokens):
+        """
+        Yield a Match for every lexicon entry found in the token list.
+
+        At each position, longer entries are reported before shorter ones.
+        tokens are expected to be lowercase.
+        """
+        root = self._root
+        for start in xrange(len(tokens)):
+            found = []
+            node = root
+            end = start
+            while end < len(tokens):
+                node = node.get(tokens[end])
+                if node is None:
+                    break
+                end += 1
+                if _END in node:
+                    found.append((end, node[_END]))
+            for end, payloads in reversed(found):
+                for kind, lemma, form in payloads:
+                    yield Match(kind, lemma, form, start, end)
+
+
+_cache = (None, None)
+_lock = threading.Lock()
+
+def matcher_loaded():
+    return _cache[1] is not None
+
+def get_matcher():
+    """Return the Matcher for the current shared Lexicon, compiling it once."""
+    global _cache
+    lexicon = get_lexicon()
+    cached_lexicon, matcher = _cache
+    if cached_lexicon is not lexicon:
+        with _lock:
+            cached_lexicon, matcher = _cache
+            if cached_lexicon is not lexicon:
+                matcher = Matcher(lexicon)
+                _cache = (lexicon, matcher)
+    return matcher
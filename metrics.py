@@ -0,0 +1,167 @@
+# metrics.py
+# Counters and latency histograms for the pipeline, exposed in the
+# Prometheus text format.
+#
+# Timing a stage costs two time.time() calls and one short lock.  While a
+# request is being traced (start_trace / end_trace, on the request's thread)
+# the stages it runs are also collected for the Server-Timing header.
+
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+from collections import OrderedDict
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+registry = OrderedDict()
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry[name] = self
+
+    def header(self):
+        return ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+
+class Counter(Metric):
+    """A monotonically increasing count, per combination of label values."""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super(Counter, self).__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self.values.items()):
+            lines.append('%s%s %s' % (self.name, _format_labels(self.labels, labels), _format_value(value)))
+        return lines
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, per combination of label values."""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # labels -> [per-bucket counts (last is +Inf), sum]
+
+    def observe(self, value, labels=()):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = self.header()
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name,
+                    _format_labels(self.labels, labels, [('le', _format_value(bound))]), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, _format_labels(self.labels, labels), _format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(self.labels, labels), cumulative))
+        return lines
+
+class CallbackMetric(Metric):
+    """
+    A metric whose values are read from callback when rendered, for numbers
+    something else already keeps (cache hit counts, for example).  callback
+    returns (label values, value) pairs.
+    """
+
+    def __init__(self, name, help, kind, labels, callback):
+        super(CallbackMetric, self).__init__(name, help, labels)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self):
+        lines = self.header()
+        for labels, value in self.callback():
+            lines.append('%s%s %s' % (self.name, _format_labels(self.labels, labels), _format_value(value)))
+        return lines
+
+def render():
+    """Return every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in registry.values():
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+STAGE_SECONDS = Histogram('recipe_stage_seconds', 'Time spent in each pipeline stage.', ['stage'])
+
+_trace = threading.local()
+
+def start_trace():
+    _trace.stages = OrderedDict()
+
+def end_trace():
+    """Stop tracing this thread and return {stage: total seconds}, in first-seen order."""
+    stages = getattr(_trace, 'stages', None)
+    _trace.stages = None
+    return stages or OrderedDict()
+
+def record(stage, seconds):
+    STAGE_SECONDS.observe(seconds, (stage,))
+    stages = getattr(_trace, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+class stage_timer(object):
+    """Context manager that records the time spent in its block under stage."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.time() - self.start)
+        return False
+
+def timed(stage):
+    """Decorator form of stage_timer."""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage, time.time() - start)
+        return wrapper
+    return decorate
+
+def server_timing(stages):
+    """Format end_trace() output as a Server-Timing header value, in milliseconds."""
+    return ', '.join('%s;dur=%.1f' % (stage, seconds * 1000) for stage, seconds in stages.iteritems())
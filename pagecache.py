@@ -0,0 +1,239 @@
+# pagecache.py
+# A persistent on-disk cache for the web pages we scrape.
+#
+# Pages are stored compressed under a directory named for the SHA-1 of
+# their URL, alongside a small JSON record of the response validators.
+# Fresh entries are served straight from disk; stale ones are revalidated
+# with If-None-Match / If-Modified-Since.  In offline mode the network is
+# never touched, so batch jobs can replay the resources/*_recipe_set.txt
+# corpora once they have been warmed.
+
+import os
+import sys
+import json
+import time
+import zlib
+import errno
+import hashlib
+import tempfile
+import threading
+import urllib2
+
+CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '.page_cache')
+CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 7 * 24 * 60 * 60)) # Seconds.
+CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+OFFLINE = os.environ.get('PAGE_CACHE_OFFLINE', '') not in ('', '0', 'false')
+TIMEOUT = 30
+# Evictions delete down to this fraction of max_bytes, so the cache can take
+# a run of new pages before it has to walk the tree again.
+EVICT_TO = 0.9
+
+class PageCacheMiss(IOError):
+    """Raised in offline mode when a page has never been cached."""
+    pass
+
+def _url_key(url):
+    return hashlib.sha1(url.encode('utf-8') if isinstance(url, unicode) else url).hexdigest()
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(data)
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+class PageCache(object):
+    def __init__(self, root=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES,
+                 offline=OFFLINE, timeout=TIMEOUT):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.bytes_fetched = 0
+        # Compressed bytes on disk, found by one walk of the tree on the
+        # first write and kept up to date after that.  Other processes
+        # sharing the directory aren't counted, but every eviction re-walks
+        # the tree and resets it.
+        self._total_bytes = None
+
+    def _paths(self, url):
+        key = _url_key(url)
+        base = os.path.join(self.root, key[:2], key)
+        return base + '.z', base + '.json'
+
+    def _read(self, url):
+        """Return (body, meta) for url, or (None, None) if it isn't cached."""
+        data_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as fin:
+                meta = json.load(fin)
+            with open(data_path, 'rb') as fin:
+                body = zlib.decompress(fin.read())
+        except (IOError, OSError, ValueError, zlib.error):
+            return None, None
+        os.utime(data_path, None) # Record the access for LRU eviction.
+        return body, meta
+
+    def _write(self, url, body, meta):
+        data_path, meta_path = self._paths(url)
+        try:
+            os.makedirs(os.path.dirname(data_path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        data = zlib.compress(body, 6)
+        try:
+            replaced = os.path.getsize(data_path)
+        except OSError:
+            replaced = 0
+        _write_atomic(data_path, data)
+        _write_atomic(meta_path, json.dumps(meta))
+        self._grew(len(data) - replaced)
+
+    def _grew(self, delta):
+        """Add delta to the running size of the cache, evicting if it is now too big."""
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += delta
+            over = self._total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        """Return (mtime, size, path) for every cached page body."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.z'):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _touch(self, url, meta):
+        meta['fetched'] = time.time()
+        _write_atomic(self._paths(url)[1], json.dumps(meta))
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            setattr(self, stat, getattr(self, stat) + amount)
+
+    def get(self, url):
+        """Return the cached body for url regardless of its age, or None."""
+        return self._read(url)[0]
+
+    def fetch(self, url):
+        """Return the body of url, from the cache where possible."""
+        body, meta = self._read(url)
+        if body is not None and (self.offline or time.time() - meta['fetched'] < self.ttl):
+            self._count('hits')
+            return body
+        if self.offline:
+            self._count('misses')
+            raise PageCacheMiss('%s is not in the page cache (offline mode)' % url)
+
+        request = urllib2.Request(url)
+        if meta:
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError as e:
+            if e.code == 304 and body is not None:
+                self._count('revalidations')
+                self._touch(url, meta)
+                return body
+            raise
+        except (urllib2.URLError, IOError):
+            if body is not None: # Better stale than nothing.
+                self._count('hits')
+                return body
+            raise
+
+        self._count('misses')
+        new_body = response.read()
+        self._count('bytes_fetched', len(new_body))
+        headers = response.info()
+        self._write(url, new_body, {
+            'url': url,
+            'fetched': time.time(),
+            'etag': headers.getheader('ETag'),
+            'last_modified': headers.getheader('Last-Modified'),
+            'size': len(new_body),
+        })
+        return new_body
+
+    def evict(self, target=None):
+        """
+        Delete least recently used entries until the cache fits in target
+        bytes, by default EVICT_TO of max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        if target is None:
+            target = int(self.max_bytes * EVICT_TO)
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                for victim in (path, path[:-2] + '.json'):
+                    try:
+                        os.remove(victim)
+                    except OSError:
+                        pass
+                total -= size
+            self._total_bytes = total
+
+    def warm(self, urls, signal=True):
+        """
+        Make sure every URL in urls is cached, returning the ones that failed.
+
+        If signal, print a warning for every failure.
+        """
+        failed = []
+        for url in urls:
+            try:
+                self.fetch(url)
+            except (IOError, urllib2.URLError) as e:
+                failed.append(url)
+                if signal:
+                    sys.stderr.write('Warning: could not cache %s: %s\n' % (url, e))
+        return failed
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                    'bytes_fetched': self.bytes_fetched}
+
+page_cache = PageCache()
+
+def fetch(url):
+    """Return the body of url through the shared page cache."""
+    return page_cache.fetch(url)
+
+if __name__ == '__main__':
+    # Usage: python pagecache.py resources/recipe_set.txt [more recipe files...]
+    for file in sys.argv[1:]:
+        with open(file) as fin:
+            page_cache.warm([l.strip() for l in fin if l.strip()])
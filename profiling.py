@@ -0,0 +1,108 @@
+# profiling.py
+# Profile a single call two ways at once: cProfile for sorted cumulative
+# stats, and a sampling thread that snapshots the calling thread's stack
+# for flamegraph-compatible collapsed stacks ("a;b;c count" lines, as read
+# by flamegraph.pl and speedscope).  Nothing here runs unless asked to.
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from StringIO import StringIO
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.001 # Seconds between stack samples.
+STATS_LIMIT = 60 # Rows of cumulative stats to report.
+
+# Functions whose share of the time is called out separately in the report,
+# as pstats restrictions (regular expressions over "file:line(function)").
+FOCUS = [
+    ('pick_one', r'\(pick_one\)'),
+    ('walk_ancestors', r'\(walk_ancestors\)'),
+    ('pos_tag', r'\(pos_tag'),
+    ('regex substitution', r"\((sub|_swap)\)|method 'sub'"),
+]
+
+def _frame_label(frame):
+    code = frame.f_code
+    return '%s (%s)' % (code.co_name, os.path.basename(code.co_filename))
+
+class StackSampler(threading.Thread):
+    """Counts the stacks of thread thread_id every interval seconds until stopped."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super(StackSampler, self).__init__(name='stack-sampler')
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join('%s %d\n' % item for item in sorted(self.stacks.iteritems()))
+
+class Report(object):
+    """The results of profile_call: wall time, cumulative stats and collapsed stacks."""
+
+    def __init__(self, profile, sampler, seconds):
+        self.seconds = seconds
+        self.stats = pstats.Stats(profile, stream=StringIO())
+        self.collapsed = sampler.collapsed()
+        self.samples = sum(sampler.stacks.itervalues())
+
+    def cumulative(self, limit=STATS_LIMIT, restrictions=()):
+        out = StringIO()
+        self.stats.stream = out
+        self.stats.sort_stats('cumulative').print_stats(*(tuple(restrictions) + (limit,)))
+        return out.getvalue()
+
+    def focus(self):
+        return dict((name, self.cumulative(restrictions=[pattern])) for name, pattern in FOCUS)
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds,
+            'samples': self.samples,
+            'cumulative': self.cumulative(),
+            'focus': self.focus(),
+            'collapsed': self.collapsed,
+        }
+
+    def save(self, directory, name):
+        """Write name.pstats and name.collapsed under directory; return their paths."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        base = os.path.join(directory, name)
+        self.stats.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w') as fout:
+            fout.write(self.collapsed)
+        return [base + '.pstats', base + '.collapsed']
+
+def profile_call(function, *args, **kwargs):
+    """Call function under both profilers.  Return (its result, Report)."""
+    sampler = StackSampler(threading.current_thread().ident)
+    profile = cProfile.Profile()
+    sampler.start()
+    start = time.time()
+    try:
+        result = profile.runcall(function, *args, **kwargs)
+    finally:
+        seconds = time.time() - start
+        sampler.stop()
+    return result, Report(profile, sampler, seconds)
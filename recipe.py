@@ -1,25 +1,23 @@
 # -*- coding: utf-8 -*-
-import urllib
+import os
 import re
-import nltk
+import glob
+import threading
 from bs4 import BeautifulSoup
 from collections import Counter, defaultdict
-from nltk.tokenize import RegexpTokenizer
 from urlparse import urljoin
 import random
 from food import *
+from lexicon import get_lexicon, lexicon_loaded
+from matcher import get_matcher, matcher_loaded, TOOL, METHOD, VERB_TOOL
+from document import RecipeDocument
+from cache import LRUCache
+import pagecache
+import lazy
+import metrics
+from metrics import stage_timer
 #from crawl import *
 
-UNITS_FILE = "resources/units.txt"
-TOOLS_FILE = "resources/tools.txt"
-METHODS_FILE = "resources/methods.txt"
-VEGETARIAN_SUBSTITUTES = "resources/VegetarianIngredientSubstitutes.csv"
-
-units = []
-tools = []
-methods = []
-preparations = []
-
 FREQ_FILE_I = 'resources/freq_set_i.txt'
 FREQ_FILE_F = 'resources/freq_set_f.txt'
 FREQ_FILE_G = 'resources/freq_set_g.txt'
@@ -28,95 +26,70 @@ FREQ_FILE_HEALTHY = 'resources/freq_set_healthy.txt'
 FREQ_FILE_LOWCAL = 'resources/freq_set_lowCal.txt'
 FREQ_FILE_LOWFAT = 'resources/freq_set_lowFat.txt'
 
+def _load_tagger():
+    # Importing NLTK and loading the perceptron tagger takes seconds, so
+    # both happen on first use.  Tagging one word forces the model to load.
+    import nltk
+    nltk.pos_tag(['salt'])
+    return nltk
 
-verb_tool = {
-  'heat':'oven',
-  'fry':'pan',
-  'chop':'knife',
-  'cut':'knife',
-  'julienne':'knife',
-  'mince':'knife',
-  'dice':'knife',
-  'minced':'knife',
-  'slice':'knife',
-  'stir':'spoon',
-  'fold':'spoon',
-  'glaze':'spoon',
-  'drizzle':'spoon',
-  'baste':'baster',
-  'sift':'colander',
-  'cream':'hand mixer',
-  'grate':'grater',
-  'whisk':'whisk',
-  'marinate':'bowl',
-  'shred':'food processor',
-  'peel':'peeler',
-}
+# Heavy shared state, loaded on first use (or by lazy.warm_up).  The lexicon
+# and matcher are module singletons that can be reloaded, so the request path
+# calls get_lexicon/get_matcher directly and the probes report them.
+lazy.register('lexicon', get_lexicon, lexicon_loaded)
+lazy.register('matcher', get_matcher, matcher_loaded)
+tagger_component = lazy.register('tagger', _load_tagger)
+graph_component = lazy.register('graph', food_graph)
 
-#http://www.recipetips.com/kitchen-tips/t--482/units-of-measure.asp
-unit_abbreviation = {
-	'qt': 'quart',
-    't': 'teaspoon',
-    'tsp':'teaspoon',
-    'c':'cup',
-    'oz':'ounce',
-    'pt': 'pint',
-    'gal':'gallon',
-    'lb':'pound'
-}
+def get_graph():
+    return graph_component.get()
+
+_graph_version = []
+
+def graph_version():
+    """A hash of the files the food graph is built from, for cache keys."""
+    if not _graph_version:
+        _graph_version.append(snapshot_key(CATEGORY_FILES + SUBSTITUTE_FILES + PROPERTIES_FILES + SYNONYM_FILES))
+    return _graph_version[0]
+
+def get_tagger():
+    return tagger_component.get()
+
+# Same pattern and flags as NLTK's RegexpTokenizer(r'\w+'), without importing NLTK.
+_word_re = re.compile(r'\w+', re.UNICODE | re.MULTILINE | re.DOTALL)
 
-graph = food_graph()
+def tokenize_words(text):
+    return _word_re.findall(text)
 
 def fetch_recipe(url):
     '''
     Input: the URL for a recipe, 
     Output:a dictionary of the parsed results
     '''
-    read_file()
-    r = urllib.urlopen(url).read()
-    soup = BeautifulSoup(r, "html.parser")
+    with stage_timer('fetch'):
+        r = pagecache.fetch(url)
+    with stage_timer('parse_document'):
+        doc = RecipeDocument.from_html(r)
     results = {}
-    get_ingredients(soup, results)
-    get_directions(soup)
-    get_methods(soup, results)
-    get_tools(soup, results)
-    get_steps(soup, results)
-    get_structuredsteps(soup, results)
+    with stage_timer('get_ingredients'):
+        get_ingredients(doc, results)
+    with stage_timer('get_methods'):
+        get_methods(doc, results)
+    with stage_timer('get_tools'):
+        get_tools(doc, results)
+    get_steps(doc, results)
+    with stage_timer('get_structuredsteps'):
+        get_structuredsteps(doc, results)
 
     #test print recipe
     #print_recipe(results)
     return results
 
-def read_file():
-    text_file = open(UNITS_FILE, "r")
-    lines = text_file.readlines()
-    global units
-    for x in lines:
-        new = x.rstrip('\n')
-        units.append(unicode(new, 'utf-8'))
-
-    text_file = open(TOOLS_FILE, "r")
-    lines = text_file.readlines()
-    global tools
-    for x in lines:
-        new = x.rstrip('\n')
-        tools.append(new)
-
-    text_file = open(METHODS_FILE, "r")
-    lines = text_file.readlines()
-    global methods
-    for x in lines:
-        new = x.rstrip('\n')
-        methods.append(new)
-
-
-
-def get_ingredients(soup, dct):
+def get_ingredients(doc, dct):
     dct["ingredients"] = []
-    letters = soup.find_all("span", itemprop="ingredients")
 
-    for element in letters:
-        quantity, measurement, name, preparation, descriptor = parse_ingredient(element.get_text().lower())
+    parsed = parse_ingredients([line.lower() for line in doc.ingredients])
+    for quantity, measurement, name, preparation, descriptor in parsed:
         d = {
           'name': unicode(name),
           'quantity':quantity,
@@ -127,11 +100,11 @@ def get_ingredients(soup, dct):
         dct["ingredients"].append(d)
 
 
-def get_structuredsteps(soup, dct):
+def get_structuredsteps(doc, dct):
     dct['structuredsteps'] = []
     new_steps = dct['steps']
     new_ingredients = dct['ingredients']
-    tokenizer = RegexpTokenizer(r'\w+')
+    matcher = get_matcher()
 
     time_units = ['min', 'minutes', 'minute', 'hour', 'hours', 'hr', 'hrs', 'min.', 'hr.', 'hrs.' ]
 
@@ -141,28 +114,14 @@ def get_structuredsteps(soup, dct):
 
     for step in new_steps:
         if step != '':
+            step_list = tokenize_words(step)
             method_list = []
-            for method in methods:
-                if method in step:
-                    method_list.append(method)
-                elif method + "ing" in step:
-                    method_list.append(method)
-                elif method + "s" == step:
-                    method_list.append(method)
-                elif method + "er" == step:
-                    method_list.append(method)
-                elif method + "ed" == step:
-                    method_list.append(method)
-                elif method + "ing" == step:
-                    method_list.append(method)
             tools_list = []
-            for tool in tools:
-                if tool in step:
-                    tools_list.append(tool)
-
-            for verb in verb_tool:
-                if verb in step:
-                    tools_list.append(verb_tool[verb])
+            for match in matcher.scan(step_list):
+                if match.kind == METHOD:
+                    method_list.append(match.lemma)
+                else: # TOOL or VERB_TOOL
+                    tools_list.append(match.lemma)
             ingredient_list = []
             for x in ingredient_names:
                 for y in x.split():
@@ -170,7 +129,6 @@ def get_structuredsteps(soup, dct):
                         ingredient_list.append(x)
 
             cooking_time = " "
-            step_list = tokenizer.tokenize(step)
 
             for x in range(0,len(step_list)-2):
                 if step_list[x].isdigit():
@@ -188,27 +146,55 @@ def get_structuredsteps(soup, dct):
 
 
 
-def parse_ingredient(ingredient):
+# Parsed ingredient lines, keyed by the Lexicon they were parsed with and the
+# normalized line.  Lines like "1 teaspoon salt" recur constantly, so most
+# lines skip NLTK entirely; after reload_lexicon they are parsed afresh, and
+# the entries for the old Lexicon age out.
+INGREDIENT_CACHE_SIZE = 4096
+ingredient_cache = LRUCache(INGREDIENT_CACHE_SIZE)
+
+def normalize_ingredient(ingredient):
+    return ' '.join(ingredient.split())
+
+def parse_ingredients(ingredients):
+    """
+    Parse a list of ingredient lines, returning one parse_ingredient tuple
+    per line.  Lines missing from ingredient_cache are POS tagged together
+    with a single pos_tag_sents call.
+    """
+    lexicon = get_lexicon()
+    keys = [normalize_ingredient(ingredient) for ingredient in ingredients]
+    results = [ingredient_cache.get((lexicon, key)) for key in keys]
+    missing = sorted(set(key for key, result in zip(keys, results) if result is None))
+    if missing:
+        with stage_timer('pos_tag'):
+            tagged = get_tagger().pos_tag_sents([key.split() for key in missing])
+        parsed = {}
+        for key, tags in zip(missing, tagged):
+            parsed[key] = parse_ingredient(key, tags=tags, lexicon=lexicon)
+            ingredient_cache.put((lexicon, key), parsed[key])
+        results = [parsed[key] if result is None else result for key, result in zip(keys, results)]
+    return results
+
+def parse_ingredient(ingredient, tags=None, lexicon=None):
+    # tags may be given as the POS tags of ingredient.split(), as produced
+    # in bulk by parse_ingredients; otherwise the line is tagged here.
+    # lexicon defaults to the shared one.
     quantity = 0
     name = ''
     measurement = ''
     preparation = ''
     descriptors = set()
 
-    global unit_abbreviation
-    synonyms = []
-
-    global units
-
-    for key in unit_abbreviation:
-        synonyms.append(key)
-
+    if lexicon is None:
+        lexicon = get_lexicon()
+    units = lexicon.unit_set
 
     ingLst = ingredient.split()
 
 
     # parsing descriptor
-    PosIngList = nltk.pos_tag(ingLst)
+    PosIngList = tags if tags is not None else get_tagger().pos_tag(ingLst)
     #print PosIngList
     for index, tup in enumerate(PosIngList):
     	ele, typ = tup[0], tup[1]
@@ -221,8 +207,7 @@ def parse_ingredient(ingredient):
     quantityR = []
     measurementR = []
     for index, word in enumerate(ingLst):
-        if word in synonyms:
-            word = unit_abbreviation[word]
+        word = lexicon.normalize_unit(word)
         if unicode(word[0]).isnumeric() and re.search(r'^\d\/\d+$', word):
             if quantity == '':
                 quantity = float(convert(word))
@@ -294,106 +279,64 @@ def convert(s):
         return float(num) / float(denom)
 
 
-def get_directions(soup):
-    directions_string = ""
-    directions = soup.find_all("span", class_="recipe-directions__list--item")
-    for element in directions:
-        #print str(element.text)
-        directions_string += " " + str(element.text)
-    return directions_string
-
-def get_steps(soup, dct):
-    dct['steps'] = []
-    directions = soup.find_all("span", class_="recipe-directions__list--item")
-    for element in directions:
-        if element != '':
-            dct['steps'].append(str(element.text).lower())
+def get_directions(doc):
+    return doc.directions_string
+
+def get_steps(doc, dct):
+    dct['steps'] = list(doc.steps)
     return
 
 
-def get_tools(soup, dct):
+def get_tools(doc, dct):
     cnt = Counter()
     dct["cooking tools"] = []
 
-    tokenizer = RegexpTokenizer(r'\w+')
 
-    directions_string = get_directions(soup)
+    directions_string = get_directions(doc)
 
     ingredients= dct['ingredients']
 
-    global tools
-
-    directions_list = map(lambda x:x.lower(),tokenizer.tokenize(directions_string))
-
-    used_list = []
-    for x in range(len(directions_list)):
-        if x + 2 < len(directions_list):
-            two_word_tool = directions_list[x] + ' ' + directions_list[x+1]
-            three_word_tool = directions_list[x] + ' ' + directions_list[x+1] + ' ' + directions_list[x+2]
-            used_word = directions_list[x+1]
-            used_word_two = directions_list[x+2]
-
-        one_word_tool = directions_list[x]
-        for tool in tools:
-            if tool == two_word_tool:
-                used_list.append(used_word)
-                cnt[tool] += 1
-            elif tool == three_word_tool:
-                used_list.append(used_word)
-                used_list.append(used_word_two)
-                cnt[tool] += 1
+    matcher = get_matcher()
 
-            elif tool == one_word_tool and tool not in used_list:
-                cnt[tool] +=1
+    directions_list = map(lambda x:x.lower(),tokenize_words(directions_string))
 
-        for verb in verb_tool:
-            tool = verb_tool[verb]
-            if directions_list[x] == verb and tool not in cnt:
-                cnt[tool] +=1
+    used_list = set()
+    for match in matcher.scan(directions_list):
+        if match.kind == TOOL:
+            if match.end - match.start > 1:
+                # Words inside a multi-word tool don't count as tools on their own.
+                used_list.update(directions_list[match.start + 1:match.end])
+                cnt[match.lemma] += 1
+            elif match.lemma not in used_list:
+                cnt[match.lemma] += 1
+        elif match.kind == VERB_TOOL and match.lemma not in cnt:
+            cnt[match.lemma] += 1
 
     for x in ingredients:
-        for verb in verb_tool:
-            tool = verb_tool[verb]
-            if verb in x['name'] and tool not in cnt:
-                cnt[tool] += 1
+        for match in matcher.scan(tokenize_words(x['name'].lower())):
+            if match.kind == VERB_TOOL and match.lemma not in cnt:
+                cnt[match.lemma] += 1
 
     for x in cnt.most_common():
         dct["cooking tools"].append(x[0])
 
-def get_methods(soup, dct):
+def get_methods(doc, dct):
     cnt = Counter()
     dct["cooking methods"] = []
     dct["primary cooking method"] = " "
-    tokenizer = RegexpTokenizer(r'\w+')
-    title = soup.title.text
+    title = doc.title
     # get rid of "- allrecipes.com"
     dct["title"] = title[:-17].lower()
 
-    directions_string = get_directions(soup)
-
-    global methods
-
-    directions_list = tokenizer.tokenize(directions_string)
-
-    for x in directions_list:
-        for y in methods:
-            if y + "ing" == x.lower():
-                cnt[y] += 1
-                cnt[y + "ing"] += 1
-            elif y + "s" == x.lower():
-                cnt[y]+=1
-                cnt[y+ "s"] += 1
-            elif y + "er" == x.lower():
-                cnt[y] += 1
-                cnt[y + "er"] += 1
-            elif y + "ed" == x.lower():
-                cnt[y] += 1
-                cnt[y + 'ed'] += 1
-            elif y[:-1]+ "ing" == x.lower():
-                cnt[y]+=1
-                cnt[y[:-1]+ "ing"] +=1
-            elif y == x.lower():
-                cnt[y] += 1
+    directions_string = get_directions(doc)
+
+    directions_list = map(lambda x:x.lower(),tokenize_words(directions_string))
+
+    for match in get_matcher().scan(directions_list):
+        if match.kind == METHOD:
+            cnt[match.lemma] += 1
+            if match.form:
+                cnt[match.form] += 1
 
     max_list = []
     max_cnt = 1
@@ -454,7 +397,7 @@ def fetchRecipeURL(req_recipe):
     baseURL = 'http://allrecipes.com/search/results/'
     params = '?wt=' + req_recipe.replace(' ', '%20') + '&sort=re'
 
-    r = urllib.urlopen(baseURL + params).read()
+    r = pagecache.fetch(baseURL + params)
     soup = BeautifulSoup(r, "html.parser")
 
     baseSite = 'http://allrecipes.com'
@@ -474,38 +417,76 @@ def replaceWholeWord(sentence, replacement, sub):
     #        words[index] = str(sub)
     #return " ".join(words)
 
-def replaceIngredients(recipe, substitutes):
+class SubstitutionMap(object):
+    """
+    Whole-word, case-insensitive replacement of several words at once.
+
+    All the words are compiled into one alternation, longest first so
+    "chicken breast" wins over "chicken", and each text is rewritten in a
+    single pass with a dict lookup for the replacement.
+    """
+
+    def __init__(self, swaps):
+        self.swaps = dict((word.lower(), swap) for word, swap in swaps.iteritems() if word)
+        self.pattern = _substitution_pattern(tuple(sorted(self.swaps)))
+
+    def _swap(self, match):
+        return self.swaps[match.group(0).lower()]
+
+    def sub(self, text):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self._swap, text)
+
+# Compiled patterns, keyed by the words they match.
+substitution_patterns = LRUCache(256)
+
+def _substitution_pattern(words):
+    if not words:
+        return None
+    pattern = substitution_patterns.get(words)
+    if pattern is None:
+        alternation = '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+        pattern = re.compile(r'\b(?:%s)\b' % alternation, re.I)
+        substitution_patterns.put(words, pattern)
+    return pattern
+
+@metrics.timed('replaceIngredients')
+def replaceIngredients(recipe, substitutes, rng=random):
+    # rng picks among each ingredient's substitutes; pass a seeded
+    # random.Random for reproducible results.
+    swaps = {}
     for replacement in substitutes:
         substitute = substitutes[replacement]
-        swap = str(random.choice(substitute).name) if substitute else str(replacement)
+        swap = str(rng.choice(substitute).name) if substitute else str(replacement)
 
         # if has wordnet naming scheme, extract food name
         if "." in swap:
             swap = swap.split(".")[0]
+        swaps[str(replacement)] = swap
 
-        for ingredient in recipe['ingredients']:
-            name = str(ingredient['name'])
-            ingredient['name'] = replaceWholeWord(name, str(replacement), swap)
+    if not swaps:
+        return recipe
+    substitution = SubstitutionMap(swaps)
 
-        for index, step in enumerate(recipe['steps']):
-            recipe['steps'][index] = replaceWholeWord(step, str(replacement), swap)
+    for ingredient in recipe['ingredients']:
+        ingredient['name'] = substitution.sub(str(ingredient['name']))
 
-        for i, strucstep in enumerate(recipe['structuredsteps']):
-            ingredients = strucstep['ingredients']
-            step = strucstep['step']
+    recipe['steps'][:] = [substitution.sub(step) for step in recipe['steps']]
 
-            for j, ingredient in enumerate(ingredients):
-                recipe['structuredsteps'][i]['ingredients'][j] = replaceWholeWord(ingredient, str(replacement), swap)
-            recipe['structuredsteps'][i]['step'] = replaceWholeWord(step, str(replacement), swap)
+    for strucstep in recipe['structuredsteps']:
+        strucstep['ingredients'][:] = [substitution.sub(ingredient) for ingredient in strucstep['ingredients']]
+        strucstep['step'] = substitution.sub(strucstep['step'])
 
     return recipe
 
 
+@metrics.timed('makeVegetarian')
 def makeVegetarian(recipe):
     ingredients = [x['name'] for x in recipe['ingredients']]
     substitutes = {}
     for ingredient in ingredients:
-        node = graph.pick_one(ingredient)
+        node = get_graph().pick_one(ingredient)
         if node:
             if node.has_property('meat'):
                 substitutes[ingredient] = node.get_substitutes(properties = ['-meat'])
@@ -516,61 +497,125 @@ def frequenciesToNodes(frequentIngredients):
     collect = []
     for ingredient in frequentIngredients:
         if ingredient:
-            node = graph.pick_one(ingredient)
+            node = get_graph().pick_one(ingredient)
             if node:
                 collect.append((ingredient,node))
 
     return collect 
+
+def basic_level(node):
+    """The node's siblings: every child of every one of its parents."""
+    return frozenset(child for parent in node.parents for child in parent.children)
+
+class CuisineProfile(object):
+    """
+    The frequent ingredients of one cuisine or diet, resolved to graph nodes.
+
+    entries holds (ingredient, node, basic level) triples, most frequent
+    ingredient first.  by_sibling maps each node in any basic level to the indexes of
+    the entries containing it, so a recipe ingredient's candidates can be
+    found without comparing it against every entry.
+    """
+
+    def __init__(self, name, file):
+        self.name = name
+        self.file = file
+        counts = read_freq_file(file)
+        # Most frequent first, then by name, so seeded picks are reproducible.
+        frequent = sorted(order_freq(counts), key=lambda ingredient: (-counts[ingredient], ingredient))
+        self.entries = tuple((ingredient, node, basic_level(node))
+                             for ingredient, node in frequenciesToNodes(frequent))
+        by_sibling = defaultdict(list)
+        for i, (_, _, siblings) in enumerate(self.entries):
+            for sibling in siblings:
+                by_sibling[sibling].append(i)
+        self.by_sibling = dict((sibling, tuple(indexes)) for sibling, indexes in by_sibling.iteritems())
+
+    def __repr__(self):
+        return '<CuisineProfile %s: %d ingredients>' % (self.name, len(self.entries))
+
+    def substitutes_for(self, ingredient, siblings):
+        """Return the profile nodes sharing a basic level with an ingredient."""
+        matches = set()
+        for sibling in siblings:
+            matches.update(self.by_sibling.get(sibling, ()))
+        return [self.entries[i][1] for i in sorted(matches) if self.entries[i][0] != ingredient]
+
+FREQ_FILE_PATTERN = 'resources/freq_set_*.txt'
+# Names for the freq_set_*.txt files whose suffix isn't already the name.
+FREQ_FILE_ALIASES = {
+    'i': 'indian',
+    'f': 'french',
+    'g': 'german',
+    'a': 'african',
+}
+DEFAULT_PROFILE = 'indian'
+
+class ProfileRegistry(object):
+    """
+    Discovers the freq_set_*.txt files and compiles each into a
+    CuisineProfile on first use (or all at once with compile_all).
+    """
+
+    def __init__(self, pattern=FREQ_FILE_PATTERN, aliases=FREQ_FILE_ALIASES, default=DEFAULT_PROFILE):
+        self.files = {}
+        for file in sorted(glob.glob(pattern)):
+            suffix = os.path.splitext(os.path.basename(file))[0][len('freq_set_'):].lower()
+            self.files[aliases.get(suffix, suffix)] = file
+        self.default = default
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return sorted(self.files)
+
+    def get(self, name):
+        """Return the compiled profile for name, falling back to the default."""
+        if name not in self.files:
+            name = self.default
+        profile = self._profiles.get(name)
+        if profile is None:
+            with self._lock:
+                profile = self._profiles.get(name)
+                if profile is None:
+                    profile = self._profiles[name] = CuisineProfile(name, self.files[name])
+        return profile
+
+    def compiled(self):
+        """Return the names of the profiles compiled so far."""
+        return sorted(self._profiles)
+
+    def compile_all(self):
+        return [self.get(name) for name in self.names()]
+
+    def clear(self):
+        with self._lock:
+            self._profiles = {}
+
+profiles = ProfileRegistry()
+# convertCuisine compiles profiles one at a time; any compiled profile
+# means the registry is usable.
+lazy.register('profiles', profiles.compile_all, lambda: bool(profiles.compiled()))
+
 #recipe.convertCuisine(fetch_recipe('http://allrecipes.com/recipe/219929/heathers-fried-chicken/'), 'indian')
+@metrics.timed('convertCuisine')
 def convertCuisine(recipe, toType):
     '''
     Inputs: Recipe Schema, And Type of cuisine you wish to convert it to "french" "indian" "african"
     '''
-    localType = FREQ_FILE_I
-    if toType == "indian":
-        localType = FREQ_FILE_I
-    elif toType == 'german':
-        localType = FREQ_FILE_G 
-    elif toType == 'french':
-        localType = FREQ_FILE_F
-    elif toType == 'african':
-        localType = FREQ_FILE_A
-    elif toType == 'healthy':
-        localType = FREQ_FILE_HEALTHY
-    elif toType == 'lowfat':
-        localType = FREQ_FILE_LOWFAT
-    elif toType == 'lowcal':
-        localType = FREQ_FILE_LOWCAL
-
-    frequentIngredients = order_freq(read_freq_file(localType))
-
-    freqNodes = frequenciesToNodes(frequentIngredients)
-
-    basicLevels = {}
-    for node in freqNodes:
-        print node
-        temp = [child for parent in node[1].parents for child in parent.children]
-        basicLevels[node] = temp
+    profile = profiles.get(toType)
 
     ingredients = [x['name'] for x in recipe['ingredients']]
 
-    recipeBasicLevels = {}
+    substitutes = {}
     for ingredient in ingredients:
-        node = graph.pick_one(ingredient)
+        node = get_graph().pick_one(ingredient)
         if node:
-            temp = [child for parent in node.parents for child in parent.children]
-            #recipeBasicLevels[(ingredient,node)] = temp
-            recipeBasicLevels[ingredient] = temp
-
-    #intersections = intersect(basicLevelList, recipeBasicLevelList) #gets the ingredient nodes that appear in the basic levels for the common items in "X" cusine and the recipe that was inputted
-    substitutes = defaultdict(list)
-    for ingredient in recipeBasicLevels:
-        for node in basicLevels:
-            if intersect(recipeBasicLevels[ingredient],basicLevels[node]):
-                if node[0] != ingredient:
-                    substitutes[ingredient].append(node[1])
-
-    return dict(substitutes)
+            subs = profile.substitutes_for(ingredient, basic_level(node))
+            if subs:
+                substitutes[ingredient] = subs
+
+    return substitutes
     
 def intersect(a, b):
     return list(set(a) & set(b))
@@ -634,10 +679,11 @@ def read_freq_file(file=FREQ_FILE_I):
 # Functions to trace references to methods/ingredients in a recipe.
 
 def find_whole_word(sentence, word):
-    return word in nltk.word_tokenize(sentence)
+    return word in get_tagger().word_tokenize(sentence)
 
-def ingredient_references(recipe, graph=graph):
+def ingredient_references(recipe, graph=None):
     """Given a recipe and a food graph, a list of ingredient nodes used in each step."""
+    graph = graph or get_graph()
     refs = []
     for index, step in enumerate(recipe['structuredsteps']):
         step_refs = []
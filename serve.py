@@ -0,0 +1,77 @@
+# serve.py
+# Production entry point: the Flask app behind a pre-forking gunicorn server.
+#
+# The food graph, lexicons and tagger are loaded once in the master process
+# before it forks, so every worker starts warm and shares them copy-on-write
+# instead of building its own.  Configuration comes from the environment:
+#
+#   WEB_BIND              address to listen on (default 0.0.0.0:$PORT, or :5000)
+#   WEB_WORKERS           worker processes (default: one per core)
+#   WEB_THREADS           threads per worker (default 1)
+#   WEB_TIMEOUT           with one thread per worker (the sync worker), the
+#                         seconds a request may run before its worker is
+#                         killed and replaced (default 60).  With more
+#                         threads (the gthread worker) it only bounds how
+#                         long a worker may go without a heartbeat, so a
+#                         stuck request can hold its thread indefinitely;
+#                         page fetches still give up after pagecache.TIMEOUT
+#                         seconds without data
+#   WEB_GRACEFUL_TIMEOUT  seconds workers get to finish requests on restart
+#                         or shutdown (default 30)
+#   WEB_MAX_REQUESTS      recycle a worker after this many requests (default
+#                         0, never)
+#
+# Send the master SIGHUP for a graceful restart of the workers, or SIGTERM
+# to shut down after in-flight requests finish.
+
+import os
+import sys
+import multiprocessing
+
+import lazy
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def options():
+    """Return the gunicorn settings described above."""
+    threads = _env_int('WEB_THREADS', 1)
+    return {
+        'bind': os.environ.get('WEB_BIND', '0.0.0.0:%s' % os.environ.get('PORT', 5000)),
+        'workers': _env_int('WEB_WORKERS', multiprocessing.cpu_count()),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'timeout': _env_int('WEB_TIMEOUT', 60),
+        'graceful_timeout': _env_int('WEB_GRACEFUL_TIMEOUT', 30),
+        'max_requests': _env_int('WEB_MAX_REQUESTS', 0),
+        'max_requests_jitter': _env_int('WEB_MAX_REQUESTS', 0) // 10,
+        'preload_app': True,
+    }
+
+def load_app():
+    """Import the app and load every shared component before returning it."""
+    import main
+    main.app.config['DEBUG'] = False
+    lazy.warm_up(background=False)
+    return main.app
+
+def run():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.stderr.write('serve.py needs gunicorn (pip install gunicorn futures); '
+                         'use python main.py for the development server\n')
+        sys.exit(1)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options().iteritems():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()
+
+    Server().run()
+
+if __name__ == '__main__':
+    run()
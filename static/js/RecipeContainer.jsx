@@ -46,46 +46,83 @@ var RecipeContainer = React.createClass({
     });
   },
 
-  renderRecipe: function (recipe, prevRecipe) {
-    this.setState({
-      recipe: recipe,
-      prev: prevRecipe,
-      loading: false
-    });
+  renderStage: function (event) {
+    // One line of /streamRecipe: the original first, then each transform.
+    switch (event.stage) {
+      case 'old':
+        this.setState({ prev: event.recipe });
+        break;
+      case 'done':
+        this.setState({ recipe: this.state.recipe || this.state.prev, loading: false });
+        break;
+      case 'error':
+        this.setState({ loading: false });
+        break;
+      default:
+        this.setState({ recipe: event.recipe });
+    }
+  },
+
+  buildRequest: function (recipeUrl) {
+    var req = {};
+
+    if (this.state.vegTransform && this.state.vegTransform.value != 'NONE') {
+      req['veg'] = true;
+    }
+
+    if (this.state.cuisineTransform && this.state.cuisineTransform.value != 'NONE') {
+      req['cuisine'] = this.state.cuisineTransform.value;
+    }
+
+    if (this.state.healthTransform && this.state.healthTransform.value != 'NONE') {
+      req['health'] = this.state.healthTransform.value;
+    }
+
+    req['url'] = recipeUrl;
+    return req;
   },
 
-  fetchRecipe: function (endpoint, method, recipeUrl, callback) {
+  streamRecipe: function (endpoint, recipeUrl, onEvent) {
+    // POSTs the request to endpoint and calls onEvent for each
+    // newline-delimited JSON object as soon as it arrives.  If the response
+    // ends without a 'done' or 'error' line (a worker killed mid-stream, say),
+    // onEvent gets an 'error' so the spinner still stops.
     if (recipeUrl) {
       this.setState({
         loading: true
       });
 
-      var req = {};
-      var url = endpoint; // local
       var xmlHttp = new XMLHttpRequest();
+      var offset = 0;
+      var finished = false;
 
-      if (this.state.vegTransform && this.state.vegTransform.value != 'NONE') {
-        req['veg'] = true;
-      }
-
-      if (this.state.cuisineTransform && this.state.cuisineTransform.value != 'NONE') {
-        req['cuisine'] = this.state.cuisineTransform.value;
-      }
-
-      if (this.state.healthTransform && this.state.healthTransform.value != 'NONE') {
-        req['health'] = this.state.healthTransform.value;
-      }
-
-      req['url'] = recipeUrl;
+      var consume = function () {
+        var end;
+        while ((end = xmlHttp.responseText.indexOf('\n', offset)) != -1) {
+          var line = xmlHttp.responseText.slice(offset, end);
+          offset = end + 1;
+          if (line) {
+            var event = JSON.parse(line);
+            finished = finished || event.stage == 'done' || event.stage == 'error';
+            onEvent(event);
+          }
+        }
+      };
 
       xmlHttp.onreadystatechange = function() { 
-        if (xmlHttp.readyState == 4 && xmlHttp.status == 200) {
-          callback(xmlHttp.responseText);
+        if (xmlHttp.readyState >= 3 && xmlHttp.status == 200) {
+          consume();
+          if (xmlHttp.readyState == 4 && !finished) {
+            finished = true;
+            onEvent({ stage: 'error', error: 'response ended early' });
+          }
+        } else if (xmlHttp.readyState == 4) {
+          onEvent({ stage: 'error', error: xmlHttp.statusText });
         }
       }
-      xmlHttp.open(method, url, true);
+      xmlHttp.open('POST', endpoint, true);
       xmlHttp.setRequestHeader('Content-Type', 'application/json');
-      xmlHttp.send(JSON.stringify(req));
+      xmlHttp.send(JSON.stringify(this.buildRequest(recipeUrl)));
     }
   },
 
@@ -117,8 +154,8 @@ var RecipeContainer = React.createClass({
             recipe={this.state.recipe}
             query={this.state.query}
             onChangeRecipe={this.onChangeRecipe}
-            fetchRecipe={this.fetchRecipe}
-            renderRecipe={this.renderRecipe}
+            streamRecipe={this.streamRecipe}
+            renderStage={this.renderStage}
             onTransform={this.onTransform}
             vegTransform={this.state.vegTransform}
             cuisineTransform={this.state.cuisineTransform}
@@ -145,10 +182,7 @@ var RecipeForm = React.createClass({
   handleSubmit: function (e) {
     var props = this.props;
     e.preventDefault();
-    props.fetchRecipe('/fetchRecipe', 'POST', this.props.query, function (response) {
-      var resp = JSON.parse(response);
-      props.renderRecipe(resp.new, resp.old);
-    });
+    props.streamRecipe('/streamRecipe', this.props.query, props.renderStage);
   },
 
   render: function () {
@@ -1,12 +1,12 @@
 # subs.py
 # Functions for automatically extracting food substitutes.
 
-import urllib
 import string
 from bs4 import BeautifulSoup
+import pagecache
 
 def make_soup(url):
-	page = urllib.urlopen(url).read()
+	page = pagecache.fetch(url)
 	return BeautifulSoup(page, 'html.parser')
 
 # Scrape from foodsubs.com.
@@ -0,0 +1,46 @@
+# test_recipe.py
+# Tests for the ingredient parser.  Run with python -m unittest test_recipe.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import recipe
+from lexicon import reload_lexicon, UNITS_FILE
+
+class FakeTagger(object):
+    """Tags every word as a noun, so the tests don't need NLTK's models."""
+
+    def pos_tag_sents(self, sentences):
+        return [[(word, 'NN') for word in sentence] for sentence in sentences]
+
+class IngredientCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.get_tagger = recipe.get_tagger
+        recipe.get_tagger = FakeTagger
+        recipe.ingredient_cache.clear()
+        reload_lexicon()
+
+    def tearDown(self):
+        recipe.get_tagger = self.get_tagger
+        recipe.ingredient_cache.clear()
+        reload_lexicon()
+        shutil.rmtree(self.directory)
+
+    def test_reload_lexicon_invalidates_cached_parses(self):
+        line = '2 teaspoon salt'
+        self.assertEqual(recipe.parse_ingredients([line])[0][1], 'teaspoon')
+
+        units_file = os.path.join(self.directory, 'units.txt')
+        with open(UNITS_FILE) as fin, open(units_file, 'w') as fout:
+            fout.writelines(l for l in fin if l.strip() != 'teaspoon')
+        reload_lexicon(units_file=units_file)
+
+        quantity, measurement, name = recipe.parse_ingredients([line])[0][:3]
+        self.assertEqual(measurement, '')
+        self.assertEqual(name, 'teaspoon salt')
+
+if __name__ == '__main__':
+    unittest.main()